@@ -0,0 +1,396 @@
+from typing import Callable
+
+import numpy as np
+
+from intersection import Intersection
+from lib import (TrafficLight, TrafficFlowLaw, SIDES, LIGHT_PHASES,
+                 LIGHT_CYCLE_DUR, PRODUCER_ROAD_PASS_TIMEOUT)
+from vec_env import (DEFAULT_SPLITS, DEFAULT_DECISION_INTERVAL, DEFAULT_DT,
+                     _EnvConfig)
+
+
+# ticks of events that are not coming: a lane without green or cars, an
+# exit without a car; a lane kept out of its movement until an exit of its
+# intersection is freed
+_IDLE = np.iinfo(np.int64).max
+_STUCK = _IDLE - 1
+
+
+def _nonzero(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # np.nonzero of a 2d mask, a lot faster on the flat one
+    return np.divmod(np.flatnonzero(mask), mask.shape[1])
+
+
+# The same environments as `VecIntersectionEnv`, with the whole batch kept
+# in arrays and ticked at once. Roads, exits and the light follow the object
+# model tick by tick (tick order included, a lane reaches a freed exit first
+# if it ticks first); cars are only counted, the head car of a lane draws
+# its exit and the time it takes when it reaches the head, which is how the
+# object model draws them too, as far as queues and waits go.
+# A batch seeded through `reset` is reproducible as a whole, environments
+# do not have streams of their own. The laws are taken once, they can not
+# have a demand profile
+class BatchedIntersectionEnv:
+    def __init__(self,
+                 num_envs: int,
+                 width: int = 3,
+                 height: int = 3,
+                 laws_factory: Callable[[], dict[str, list[TrafficFlowLaw]]]
+                 = None,
+                 splits: tuple[float, ...] = DEFAULT_SPLITS,
+                 decision_interval: float = DEFAULT_DECISION_INTERVAL,
+                 episode_length: float = 3600,
+                 dt: float = DEFAULT_DT):
+        self.num_envs = num_envs
+        self.width = width
+        self.height = height
+        self.splits = splits
+        self._config = _EnvConfig(
+            num_envs, width, height, laws_factory, splits,
+            max(1, round(decision_interval/dt)), dt, episode_length
+        )
+        self.observation_shape = (self._config.observation_size,)
+        self.action_count = len(splits)
+        self._build(Intersection(
+            width, height, TrafficLight,
+            laws_factory() if laws_factory else None, seed=0
+        ))
+
+        n, lanes, exits = num_envs, self._lanes, self._exits
+        self._rng = np.random.default_rng()
+        # ticks done by every env of the batch
+        self._tick = 0
+        self._elapsed = np.zeros(n)
+        # light
+        self._phase = np.zeros(n, np.int8)
+        self._until_switch = np.zeros(n)
+        self._h_time = np.zeros(n)
+        self._green = np.zeros((n, lanes), np.bool_)
+        # lanes, `_timeout` is what is left of the pass timeout of a lane
+        # without green or cars
+        self._count = np.zeros((n, lanes), np.int32)
+        self._total = np.zeros(n, np.int64)
+        self._waited = np.zeros(n, np.int64)
+        self._head = np.zeros((n, lanes), np.intp)
+        self._timeout = np.zeros((n, lanes), np.int64)
+        self._wave_at = np.zeros((n, lanes))
+        # exits and movements: cars kept out of every movement by the
+        # movements under way, as `IntersectionOccupancy` counts them
+        self._exit_move = np.zeros((n, exits), np.intp)
+        self._blocked = np.zeros((n, self._moves), np.int16)
+        # ticks of the next wave of every lane, of its next try to enter
+        # and of the end of the car on every exit, side by side so that
+        # the next event of an env is the minimum of its row
+        self._ticks = np.zeros((n, 2*lanes + exits), np.int64)
+        self._wave_tick = self._ticks[:, :lanes]
+        self._try_tick = self._ticks[:, lanes:2*lanes]
+        self._free_tick = self._ticks[:, 2*lanes:]
+        self._next_event = np.zeros(n, np.int64)
+
+        self.obs = np.zeros((n, self._config.observation_size), np.float32)
+        self._final_obs = np.zeros_like(self.obs)
+        self._rewards = np.zeros(n, np.float32)
+        self._dones = np.zeros(n, np.bool_)
+
+    def _build(self, model: Intersection):
+        # lanes, exits and movements of the layout as flat arrays, indexed
+        # in tick order
+        size = max(self.width, self.height)
+        lanes = [prod for prods, _ in model.roads.values() for prod in prods]
+        exits = [cons for _, conss in model.roads.values() for cons in conss]
+        self._lanes, self._exits = len(lanes), len(exits)
+        lane_index = {prod: i for i, prod in enumerate(lanes)}
+        exit_index = {cons: i for i, cons in enumerate(exits)}
+
+        # position of every lane and exit in the tick of an intersection
+        def position(road, kind: int) -> int:
+            return (2*SIDES.index(road.side) + kind)*size + road.pos
+        self._lane_pos = np.array([position(p, 0) for p in lanes])
+        self._exit_pos = np.array([position(c, 1) for c in exits])
+        self._positions = 2*len(SIDES)*size
+        self._obs_cols = np.array([SIDES.index(p.side)*size + p.pos
+                                   for p in lanes])
+        self._is_h = np.array([p.side in 'LR' for p in lanes])
+
+        laws = [p.car_prod_law for p in lanes]
+        if any(law.profile is not None for law in laws):
+            raise Exception("Laws with a demand profile can not be batched")
+        self._max_cars = np.array([law._max_cars for law in laws])
+        self._wave_mean = np.array([law._mean for law in laws])
+        self._lambda = np.array([law._lambda for law in laws])
+        self._min_delay = np.array([law._min_delay for law in laws])
+        self._max_delay = np.array([law._max_delay for law in laws])
+        self._min_pass = np.array([law._min_time_on_intersec for law in laws])
+        self._pass_span = np.array([law._intersec_span for law in laws])
+
+        # movements of every lane, by the cumulative probabilities its head
+        # car picks them with
+        pairs = model.movements.movements
+        move_index = {pair: k for k, pair in enumerate(pairs)}
+        self._moves = len(pairs)
+        self._move_exit = np.array([exit_index[c] for _, c in pairs])
+        choices = [model.movements.probabilities(p) for p in lanes]
+        width = max(len(row) for row in choices)
+        self._lane_moves = np.zeros((len(lanes), width), np.intp)
+        self._lane_cum = np.ones((len(lanes), width))
+        for i, (prod, row) in enumerate(zip(lanes, choices)):
+            moves = [move_index[prod, cons] for cons, _ in row]
+            self._lane_moves[i] = moves + moves[-1:]*(width - len(moves))
+            self._lane_cum[i, :len(row)] = np.cumsum([p for _, p in row])
+
+        # conflicts[bit] is added to the counts of the movements that bit
+        # keeps out once a car takes its movement; crosswalks are never
+        # occupied here, their bits are left out
+        self._conflicts = np.zeros((len(pairs), len(pairs)), np.int16)
+        for bit, entries in enumerate(model.occupancy._blocks[:len(pairs)]):
+            for entry in entries:
+                self._conflicts[bit, entry[0]] = 1
+
+        # ticks a lane waits after a car entered, with the float steps of
+        # `ProducerRoad`
+        dt, timeout, self._pass_ticks = self._config.dt, \
+            PRODUCER_ROAD_PASS_TIMEOUT, 0
+        while timeout > 0:
+            timeout -= dt
+            self._pass_ticks += 1
+
+    def _wave_delays(self, lanes: np.ndarray) -> np.ndarray:
+        value = self._rng.exponential(size=len(lanes))/self._lambda[lanes]
+        return np.clip(value, self._min_delay[lanes], self._max_delay[lanes])
+
+    def _draw_heads(self, envs: np.ndarray, lanes: np.ndarray):
+        u = self._rng.random(len(lanes))
+        picked = (u[:, None] >= self._lane_cum[lanes]).sum(1)
+        picked = np.minimum(picked, self._lane_moves.shape[1] - 1)
+        self._head[envs, lanes] = self._lane_moves[lanes, picked]
+
+    def _schedule_waves(self, envs: np.ndarray, lanes: np.ndarray):
+        # a wave comes in the first tick starting at or after its time
+        self._wave_at[envs, lanes] += self._wave_delays(lanes)
+        self._wave_tick[envs, lanes] = np.ceil(
+            self._wave_at[envs, lanes]/self._config.dt
+        ).astype(np.int64) + 1
+
+    def _reset_envs(self, envs: np.ndarray):
+        self._elapsed[envs] = 0
+        self._phase[envs] = len(LIGHT_PHASES) - 1
+        self._until_switch[envs] = 0
+        self._h_time[envs] = LIGHT_CYCLE_DUR/2
+        self._green[envs] = False
+        self._count[envs] = 0
+        self._total[envs] = 0
+        self._timeout[envs] = 0
+        self._ticks[envs] = _IDLE
+        self._wave_at[envs] = self._tick*self._config.dt
+        self._schedule_waves(np.repeat(envs, self._lanes),
+                             np.tile(np.arange(self._lanes), len(envs)))
+        self._exit_move[envs] = -1
+        self._blocked[envs] = 0
+        self._next_event[envs] = self._ticks[envs].min(1)
+        self.obs[envs] = 0
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        self._rng = np.random.default_rng(seed)
+        self._reset_envs(np.arange(self.num_envs))
+        return self.obs
+
+    def _light_tick(self, tick: int):
+        self._until_switch -= self._config.dt
+        switched = np.flatnonzero(self._until_switch <= 0)
+        if not len(switched):
+            return
+        phase = self._phase[switched] ^ 1
+        self._phase[switched] = phase
+        # keeping previous negative timing
+        self._until_switch[switched] += np.where(
+            phase == 0, self._h_time[switched],
+            LIGHT_CYCLE_DUR - self._h_time[switched]
+        )
+        # lanes with cars keep what is left of their timeouts over the red
+        green = (phase == 0)[:, None] == self._is_h
+        was, queued = self._green[switched], self._count[switched] > 0
+        tries, timeout = self._try_tick[switched], self._timeout[switched]
+        stopped, started = was & ~green & queued, green & ~was & queued
+        timeout[stopped] = np.where(tries[stopped] == _STUCK, 0,
+                                    tries[stopped] + 1 - tick)
+        tries[stopped] = _IDLE
+        tries[started] = tick + np.maximum(timeout[started] - 1, 0)
+        self._try_tick[switched] = tries
+        self._timeout[switched] = timeout
+        self._green[switched] = green
+        self._next_event[switched] = np.minimum(self._next_event[switched],
+                                                tries.min(1))
+
+    def _arrivals(self, envs: np.ndarray, ticks: np.ndarray, tick: int):
+        # `ticks` are the rows of `envs`, lanes starting to try this tick
+        # are put into them
+        rows, lanes = _nonzero(ticks[:, :self._lanes] <= tick)
+        if not len(rows):
+            return
+        envs = envs[rows]
+        counts = self._rng.binomial(self._max_cars[lanes],
+                                    self._wave_mean[lanes])
+        self._schedule_waves(envs, lanes)
+        started = (self._count[envs, lanes] == 0) & (counts > 0)
+        if started.any():
+            envs_, lanes_ = envs[started], lanes[started]
+            self._draw_heads(envs_, lanes_)
+            green = self._green[envs_, lanes_]
+            envs_, lanes_ = envs_[green], lanes_[green]
+            tries = tick + np.maximum(self._timeout[envs_, lanes_] - 1, 0)
+            self._try_tick[envs_, lanes_] = tries
+            ticks[rows[started][green], self._lanes + lanes_] = tries
+        self._count[envs, lanes] += counts
+        np.add.at(self._total, envs, counts)
+
+    def _free(self, envs: np.ndarray, exits: np.ndarray,
+              lanes: tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        # frees all the exits freed this tick (`envs` sorted) at once; for
+        # the lanes trying this tick, counts the movements freed after them
+        # that still keep them out
+        moves = self._exit_move[envs, exits]
+        first = np.flatnonzero(np.r_[True, envs[1:] != envs[:-1]])
+        self._blocked[envs[first]] -= np.add.reduceat(
+            self._conflicts[moves], first)
+        self._exit_move[envs, exits] = -1
+        self._free_tick[envs, exits] = _IDLE
+
+        envs_, lanes_ = lanes
+        lo = np.searchsorted(envs, envs_, 'left')
+        count = np.searchsorted(envs, envs_, 'right') - lo
+        pairs = np.repeat(np.arange(len(envs_)), count)
+        freed = lo[pairs] + np.arange(len(pairs)) \
+            - np.repeat(np.cumsum(count) - count, count)
+        after = self._exit_pos[exits[freed]] > self._lane_pos[lanes_[pairs]]
+        pairs, freed = pairs[after], freed[after]
+        return np.bincount(
+            pairs, self._conflicts[moves[freed],
+                                   self._head[envs_[pairs], lanes_[pairs]]],
+            len(envs_)
+        ).astype(np.int64)
+
+    def _enter(self, envs: np.ndarray, lanes: np.ndarray, kept: np.ndarray,
+               tick: int) -> np.ndarray:
+        # lets in the lanes whose movement nothing keeps out, `kept` counts
+        # what was freed after them this tick; returns the lanes kept out
+        moves = self._head[envs, lanes]
+        admitted = self._blocked[envs, moves] + kept == 0
+        out = ~admitted
+        envs, lanes, moves = envs[admitted], lanes[admitted], moves[admitted]
+        if not len(envs):
+            return out
+        self._blocked[envs] += self._conflicts[moves]
+        exits = self._move_exit[moves]
+        self._exit_move[envs, exits] = moves
+        # the exit counts down from this tick if it ticks after the lane
+        duration = self._min_pass[lanes] \
+            + self._rng.random(len(lanes))*self._pass_span[lanes]
+        ticks = np.ceil(duration/self._config.dt).astype(np.int64) \
+            - (self._exit_pos[exits] > self._lane_pos[lanes])
+        self._free_tick[envs, exits] = tick + np.maximum(ticks, 1)
+
+        self._count[envs, lanes] -= 1
+        self._total[envs] -= 1
+        queued = self._count[envs, lanes] > 0
+        self._timeout[envs[~queued], lanes[~queued]] = self._pass_ticks
+        self._try_tick[envs[~queued], lanes[~queued]] = _IDLE
+        envs, lanes = envs[queued], lanes[queued]
+        if len(envs):
+            self._try_tick[envs, lanes] = tick + self._pass_ticks
+            self._draw_heads(envs, lanes)
+        return out
+
+    def _tick_all(self):
+        tick = self._tick = self._tick + 1
+        self._light_tick(tick)
+        self._waited += self._total
+        envs = np.flatnonzero(self._next_event <= tick)
+        if not len(envs):
+            return
+        ticks = self._ticks.take(envs, 0)
+        self._arrivals(envs, ticks, tick)
+
+        tries = ticks[:, self._lanes:2*self._lanes]
+        rows, lanes = _nonzero(tries <= tick)
+        freed_rows, exits = _nonzero(ticks[:, 2*self._lanes:] <= tick)
+        kept = np.zeros(len(rows), np.int64)
+        if len(freed_rows):
+            # lanes kept out try again if the exits freed this tick are
+            # enough to let them in, other cars entering only keep more out
+            freeing = np.unique(freed_rows)
+            stuck_rows, stuck = _nonzero(tries[freeing] == _STUCK)
+            stuck_rows = freeing[stuck_rows]
+            rows = np.concatenate([rows, stuck_rows])
+            lanes = np.concatenate([lanes, stuck])
+            order = np.argsort(rows*self._lanes + lanes)
+            rows, lanes = rows[order], lanes[order]
+            kept = self._free(envs[freed_rows], exits, (envs[rows], lanes))
+        if len(rows):
+            self._enter_in_order(envs[rows], lanes, kept, tick)
+        self._next_event[envs] = self._ticks.take(envs, 0).min(1)
+
+    def _enter_in_order(self, envs: np.ndarray, lanes: np.ndarray,
+                        kept: np.ndarray, tick: int):
+        # lanes of an env one after the other in tick order, the envs side
+        # by side: the r-th lane of every env tries in round r. Lanes kept
+        # out wait for an exit to be freed, or try again next tick if one
+        # already was
+        first = np.r_[True, envs[1:] != envs[:-1]]
+        index = np.arange(len(envs))
+        rank = index - np.maximum.accumulate(np.where(first, index, 0))
+        out = np.zeros(len(envs), np.bool_)
+        for r in range(rank.max() + 1):
+            at = np.flatnonzero(rank == r)
+            out[at] = self._enter(envs[at], lanes[at], kept[at], tick)
+        envs, lanes = envs[out], lanes[out]
+        free = self._blocked[envs, self._head[envs, lanes]] == 0
+        self._try_tick[envs, lanes] = np.where(free, tick + 1, _STUCK)
+
+    def _observe(self):
+        self.obs[:, self._obs_cols] = self._count
+        self.obs[:, -2] = self._phase == 0
+        self.obs[:, -1] = self._until_switch/LIGHT_CYCLE_DUR
+
+    def step(self, actions: np.ndarray
+             ) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        config = self._config
+        # takes effect from the next phase switch
+        self._h_time[:] = LIGHT_CYCLE_DUR*np.asarray(config.splits)[actions]
+        self._waited[:] = 0
+        for _ in range(config.ticks_per_step):
+            self._tick_all()
+        self._rewards[:] = -self._waited/config.ticks_per_step
+        self._elapsed += config.ticks_per_step*config.dt
+        self._observe()
+
+        np.greater_equal(self._elapsed, config.episode_length,
+                         out=self._dones)
+        infos = [{} for _ in range(self.num_envs)]
+        done = np.flatnonzero(self._dones)
+        if len(done):
+            self._final_obs[done] = self.obs[done]
+            for i in done:
+                infos[i]['final_observation'] = self._final_obs[i].copy()
+            self._reset_envs(done)
+        return self.obs, self._rewards, self._dones, infos
+
+    def sample_actions(self) -> np.ndarray:
+        return self._rng.integers(self.action_count, size=self.num_envs)
+
+    def close(self): ...
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    # `batched_env.py [num_envs]`
+    num_envs = int(sys.argv[1]) if sys.argv[1:] else 16384
+    env = BatchedIntersectionEnv(num_envs)
+    env.reset(seed=0)
+    steps, start = 0, time.perf_counter()
+    while steps < num_envs*20:
+        env.step(env.sample_actions())
+        steps += env.num_envs
+    print(f"{num_envs} envs: "
+          f"{steps/(time.perf_counter() - start):.0f} env-steps/s")
@@ -0,0 +1,130 @@
+import gc
+import sys
+import tracemalloc
+import warnings
+
+from intersection import Intersection
+from lib import TrafficFlowLaw, TrafficLight
+from optimized import OptimizingTrafficLight
+from memory_budget import MemoryBudget, memory_report
+
+
+LAYOUTS = (1, 2, 3, 5, 8)
+DURATIONS = (600, 3600, 4*3600)
+# mean cars per wave; 2 is light traffic, 8 oversaturates every layout
+DEMANDS = (2, 4, 8)
+DT = 0.1
+SETTLE_TICKS = 3
+
+
+def make_laws(size: int, demand: float) -> dict[str, list[TrafficFlowLaw]]:
+    return {
+        side: [
+            TrafficFlowLaw(max_cars=12, avg_car_count=demand, lambda_=1/30,
+                           min_delay=4, max_delay=200,
+                           min_time_on_intersec=0.3, max_time_on_intersec=6)
+            for _ in range(size)
+        ]
+        for side in 'TRBL'
+    }
+
+
+def measure(size: int, duration: float, demand: float,
+            budget: MemoryBudget = None) -> tuple[int, int, dict[str, int]]:
+    gc.collect()
+    tracemalloc.start()
+    model = Intersection(size, size, TrafficLight, make_laws(size, demand),
+                         seed=0)
+    if budget:
+        budget.apply(model)
+    for _ in range(int(duration/DT)):
+        model.tick(DT)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report = budget.report(model) if budget else memory_report(model)
+    return current, peak, report
+
+
+def main(budget: MemoryBudget = None):
+    print(f"{'size':>4} {'duration':>8} {'demand':>6} "
+          f"{'current KiB':>11} {'peak KiB':>9}  components, KiB")
+    for size in LAYOUTS:
+        for duration in DURATIONS:
+            for demand in DEMANDS:
+                current, peak, report = measure(size, duration, demand,
+                                                budget)
+                parts = ', '.join(
+                    f"{name}: {value if name == 'dropped cars' else value//1024}"
+                    for name, value in report.items()
+                )
+                print(f"{size:>4} {duration:>8} {demand:>6} "
+                      f"{current//1024:>11} {peak//1024:>9}  {parts}")
+
+
+def steady_tick_allocations(model: Intersection, ticks: int,
+                            dt: float = DT) -> list[int]:
+    # bytes allocated by every tick in steady state: no event fired and no
+    # history sample or optimization was taken in it or in the SETTLE_TICKS
+    # ticks before (CPython free lists emptied by an event refill in these)
+    events = [0]
+
+    def on_event(_): events[0] += 1
+    for event in (model.wave_arrived, model.car_entered_intersection,
+                  model.exit_road_cleared, model.light_changed,
+                  model.crosswalk_freed, model.crosswalk_occupied):
+        event += on_event
+    light = model.traffic_light
+
+    quiet = 0
+    tracemalloc.start()
+    # allocated while tracing: keeps the traced size out of the small int
+    # range, reading it then allocates the same amount every time
+    res, count = [0]*ticks, 0
+    for _ in range(ticks):
+        before = events[0]
+        periodic = light._time_until_next_avg <= dt \
+            or light._time_until_optim <= dt
+        # read twice: the first read leaves the tuple free list primed for
+        # the second, so that the second one adds nothing to the trace
+        current, _ = tracemalloc.get_traced_memory()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        model.tick(dt)
+        _, peak = tracemalloc.get_traced_memory()
+        quiet = quiet + 1 if events[0] == before and not periodic else 0
+        if quiet > SETTLE_TICKS:
+            res[count] = max(0, peak - current)
+            count += 1
+    tracemalloc.stop()
+    return res[:count]
+
+
+def check_allocations():
+    for light_type in (TrafficLight, OptimizingTrafficLight):
+        for size in LAYOUTS:
+            for demand in DEMANDS:
+                model = Intersection(size, size, light_type,
+                                     make_laws(size, demand), seed=0)
+                for _ in range(int(600/DT)):
+                    model.tick(DT)
+                allocs = steady_tick_allocations(model, int(1800/DT))
+                allocating = sum(1 for a in allocs if a)
+                print(f"{light_type.__name__:>22} {size:>4} {demand:>6} "
+                      f"steady ticks: {len(allocs):>5}, "
+                      f"allocating: {allocating}")
+                if allocating:
+                    raise Exception(f"{allocating} steady state ticks "
+                                    f"allocated, up to {max(allocs)} bytes")
+
+
+if __name__ == '__main__':
+    # `bench_memory.py budget` runs the same grid under a memory budget,
+    # `bench_memory.py alloc` checks that steady state ticks allocate nothing
+    if sys.argv[1:] == ['alloc']:
+        check_allocations()
+    elif sys.argv[1:] == ['budget']:
+        warnings.simplefilter('once')
+        main(MemoryBudget(max_queue=2000, history_size=50,
+                          fluid_threshold=200))
+    else:
+        main()
@@ -0,0 +1,54 @@
+from intersection import Intersection
+from lib import TrafficLight, ProducerRoad, ConsumerRoad, SIDES
+
+
+LAYOUTS = ((1, 1), (2, 3), (3, 3), (4, 2))
+DT = 0.1
+
+
+def check_crosswalks():
+    # nothing in the simulation occupies a crosswalk yet, `occupy_crosswalk`
+    # is driven from outside: an occupied crosswalk must block every
+    # movement starting or ending on its side and no other, and release
+    # them once freed
+    for width, height in LAYOUTS:
+        for side in SIDES:
+            model = Intersection(width, height, TrafficLight, seed=0)
+            occupancy = model.occupancy
+            model.occupy_crosswalk(side)
+            for prod, cons in model.movements.movements:
+                blocked = bool(occupancy._movements[prod][cons][1])
+                if blocked != (side in (prod.side, cons.side)):
+                    raise Exception(
+                        f"{width}x{height}, crosswalk {side} occupied: "
+                        f"{prod.side}{prod.pos} -> {cons.side}{cons.pos} "
+                        f"{'blocked' if blocked else 'admitted'}"
+                    )
+
+            entered: list[tuple[ProducerRoad, ConsumerRoad]] = []
+            model.car_entered_intersection += entered.append
+            for _ in range(int(1800/DT)):
+                model.tick(DT)
+            passing = [(p, c) for p, c in entered if side in (p.side, c.side)]
+            if passing:
+                p, c = passing[0]
+                raise Exception(
+                    f"{width}x{height}: {len(passing)} cars passed the "
+                    f"occupied crosswalk {side}, first {p.side}{p.pos} -> "
+                    f"{c.side}{c.pos}"
+                )
+
+            model.free_crosswalk(side)
+            entered.clear()
+            for _ in range(int(1800/DT)):
+                model.tick(DT)
+            passing = [(p, c) for p, c in entered if side in (p.side, c.side)]
+            print(f"{width}x{height} crosswalk {side}: {len(entered)} cars "
+                  f"entered after freeing it, {len(passing)} across it")
+            if not passing:
+                raise Exception(f"{width}x{height}: no car passed the "
+                                f"crosswalk {side} after it was freed")
+
+
+if __name__ == '__main__':
+    check_crosswalks()
@@ -0,0 +1,97 @@
+import random as r
+from concurrent.futures import ProcessPoolExecutor
+
+from intersection import Intersection
+from lib import KLLSketch, TrafficLight, ProducerRoad, SIDES
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# Per-car queue delays (joining a producer road until entering the
+# intersection), kept as a quantile sketch per controller and per approach
+class DelaySketches:
+    def __init__(self, k: int = 200, seed: int = None) -> None:
+        self.k = k
+        # seeds of the sketches, drawn apart from the simulation's generator
+        self._r = r.Random(seed)
+        self.sketches: dict[str, dict[str, KLLSketch]] = {}
+
+    def _sketches_for(self, controller: str) -> dict[str, KLLSketch]:
+        return self.sketches.setdefault(
+            controller, {side: KLLSketch(self.k, seed=self._r.getrandbits(64))
+                         for side in SIDES}
+        )
+
+    def track(self, model: Intersection, controller: str = None):
+        sketches = self._sketches_for(
+            controller or type(model.traffic_light).__name__
+        )
+
+        def on_car_waited(args: tuple[ProducerRoad, float]):
+            sketches[args[0].side].update(args[1])
+        model.car_waited += on_car_waited
+
+    def merge(self, other: 'DelaySketches'):
+        for controller, sides in other.sketches.items():
+            mine = self._sketches_for(controller)
+            for side, sketch in sides.items():
+                mine[side].merge(sketch)
+
+    def quantiles(self, qs: tuple[float, ...] = QUANTILES
+                  ) -> dict[str, dict[str, list[float]]]:
+        # per controller, per approach and over all approaches ('*')
+        res = {}
+        for controller, sides in self.sketches.items():
+            overall = KLLSketch(self.k, seed=self._r.getrandbits(64))
+            [overall.merge(sketch) for sketch in sides.values()]
+            res[controller] = {
+                side: sketch.quantiles(qs) for side, sketch in sides.items()
+            } | {'*': overall.quantiles(qs)}
+        return res
+
+
+def _replicate(light_type: type[TrafficLight], width: int, height: int,
+               duration: float, dt: float, seed: int,
+               k: int) -> DelaySketches:
+    r.seed(seed)
+    model = Intersection(width, height, light_type)
+    sketches = DelaySketches(k, seed)
+    sketches.track(model)
+    for _ in range(int(duration/dt)):
+        model.tick(dt)
+    return sketches
+
+
+def replicate_delays(light_types: list[type[TrafficLight]],
+                     replications: int,
+                     duration: float,
+                     width: int = 3,
+                     height: int = 3,
+                     dt: float = 0.1,
+                     k: int = 200,
+                     processes: int = None) -> DelaySketches:
+    # independent replications in a process pool, merged into one sketch set
+    res = DelaySketches(k)
+    jobs = [
+        (light_type, width, height, duration, dt, seed, k)
+        for light_type in light_types
+        for seed in range(replications)
+    ]
+    with ProcessPoolExecutor(processes) as pool:
+        for sketches in pool.map(_replicate, *zip(*jobs)):
+            res.merge(sketches)
+    return res
+
+
+if __name__ == '__main__':
+    from optimized import OptimizingTrafficLight
+
+    sketches = replicate_delays([OptimizingTrafficLight, TrafficLight],
+                                replications=8, duration=4*3600)
+    for controller, sides in sketches.quantiles().items():
+        print(controller)
+        for side, values in sides.items():
+            print(f"  {side}: " + ", ".join(
+                f"p{q*100:g}={v:.1f} s" for q, v in zip(QUANTILES, values)
+            ))
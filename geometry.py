@@ -0,0 +1,164 @@
+# Pixel layout of the intersection picture, shared by the Tk canvas in
+# `ui.App` and the offscreen renderer in `render.py`
+
+ROAD_WIDTH = 48
+ROAD_COLOR = '#203040'
+ROAD_MARK_YELLOW = '#dd4'
+ROAD_PAD_XY = 60
+
+ARROW_WIDTH = 3
+ARROW_COLOR = '#ff8800'
+
+CROSSWALK_WIDTH = 26
+CROSSWALK_GAP = 6
+CROSSWALK_COLOR = '#ccc'
+
+LIGHT_BOX_COLOR = '#aaa'
+LIGHT_LENS_COLORS = {'R': '#ff2222', 'Y': '#ffff22', 'G': '#22ff22'}
+
+# (kind, coordinates, options), kind being 'rectangle', 'line' or 'oval'
+Shape = tuple[str, tuple[float, ...], dict]
+
+
+def mids(width: int, height: int) -> tuple[int, int]:
+    return (ROAD_PAD_XY + width*(ROAD_WIDTH + 1) - 1,
+            ROAD_PAD_XY + height*(ROAD_WIDTH + 1) - 1)
+
+
+def decorations(width: int, height: int) -> list[Shape]:
+    X_MID, Y_MID = mids(width, height)
+    ROAD_CFG = dict(fill=ROAD_COLOR, width=0)
+    LINE_CFG = dict(fill=ROAD_MARK_YELLOW, width=2)
+    LANE_DELIM_LENGTH = ROAD_PAD_XY - CROSSWALK_WIDTH - 5
+
+    return [
+        # Road plates: horizontal, vertical
+        ('rectangle', (0, ROAD_PAD_XY, 2*X_MID + 1,
+                       Y_MID*2 - ROAD_PAD_XY + 1), ROAD_CFG),
+        ('rectangle', (ROAD_PAD_XY, 0, 2*X_MID - ROAD_PAD_XY + 1,
+                       2*Y_MID + 1), ROAD_CFG),
+
+        # Yellow lines: horizontal (left, right), vertical (top, bottom)
+        ('line', (0, Y_MID, ROAD_PAD_XY, Y_MID), LINE_CFG),
+        ('line', (2*X_MID - ROAD_PAD_XY, Y_MID, 2*X_MID + 1, Y_MID),
+         LINE_CFG),
+        ('line', (X_MID, 0, X_MID, ROAD_PAD_XY), LINE_CFG),
+        ('line', (X_MID, 2*Y_MID - ROAD_PAD_XY, X_MID, 2*Y_MID + 1),
+         LINE_CFG),
+    ] + [
+        # horizontal lane delimiter lines
+        ('line', (cur_x, cur_y, cur_x + LANE_DELIM_LENGTH, cur_y),
+         dict(fill='white', width=1))
+        for count in range(1, height)
+        for cur_x in (0, 2*X_MID - LANE_DELIM_LENGTH)
+        for cur_y in (count*(ROAD_WIDTH + 1) - 1 + ROAD_PAD_XY,
+                      count*(ROAD_WIDTH + 1) - 1 + Y_MID)
+    ] + [
+        # vertical lane delimiter lines
+        ('line', (cur_x, cur_y, cur_x, cur_y + LANE_DELIM_LENGTH),
+         dict(fill='white', width=0))
+        for count in range(1, width)
+        for cur_y in (0, 2*Y_MID - LANE_DELIM_LENGTH)
+        for cur_x in (count*(ROAD_WIDTH + 1) - 1 + ROAD_PAD_XY,
+                      count*(ROAD_WIDTH + 1) - 1 + X_MID)
+    ]
+
+
+def crosswalks(width: int, height: int) -> dict[str, list[tuple[int, ...]]]:
+    X_MID, Y_MID = mids(width, height)
+
+    def rectangle(x, y, w, h): return x, y, x + w, y + h
+
+    def p_left(i, line_num): return ROAD_PAD_XY + i*(ROAD_WIDTH + 1)\
+        + CROSSWALK_GAP//2 + 2*line_num*CROSSWALK_GAP
+    def p_top(i, line_num): return ROAD_PAD_XY + i*(ROAD_WIDTH + 1)\
+        + CROSSWALK_GAP//2 + 2*line_num*CROSSWALK_GAP
+
+    vertical = [
+        [
+            rectangle(cur_left, cur_top, CROSSWALK_GAP, CROSSWALK_WIDTH)
+            for cur_top in (ROAD_PAD_XY - CROSSWALK_WIDTH,
+                            2*Y_MID - ROAD_PAD_XY)
+        ]
+        for i in range(width)
+        for line_n in range(ROAD_WIDTH // (2*CROSSWALK_GAP))
+        for cur_left in (p_left(i, line_n),
+                         2*X_MID - p_left(i, line_n) - CROSSWALK_GAP)
+    ]
+    horizontal = [
+        [
+            rectangle(cur_left, cur_top, CROSSWALK_WIDTH, CROSSWALK_GAP)
+            for cur_left in (ROAD_PAD_XY - CROSSWALK_WIDTH,
+                             2*X_MID - ROAD_PAD_XY)
+        ]
+        for line_n in range(ROAD_WIDTH // (2*CROSSWALK_GAP))
+        for i in range(height)
+        for cur_top in (p_top(i, line_n),
+                        2*Y_MID - p_top(i, line_n) - CROSSWALK_GAP)
+    ]
+    top, bottom = [*zip(*vertical)]
+    left, right = [*zip(*horizontal)]
+    return {
+        side: list(cw)
+        for side, cw in zip('TRBL', (top, right, bottom, left))
+    }
+
+
+def traffic_light(width: int, height: int
+                  ) -> tuple[dict[str, tuple[int, ...]], tuple[int, ...]]:
+    # lens ovals of every side and the box they are drawn under
+    X_MID, Y_MID = mids(width, height)
+    HALF_TLB_SIZE = 10
+    LWIDTH = 6
+
+    top = (X_MID - HALF_TLB_SIZE + 1, Y_MID - HALF_TLB_SIZE - LWIDTH,
+           X_MID + HALF_TLB_SIZE - 1, Y_MID - HALF_TLB_SIZE + LWIDTH)
+    right = (X_MID + HALF_TLB_SIZE - LWIDTH, Y_MID - HALF_TLB_SIZE + 1,
+             X_MID + HALF_TLB_SIZE + LWIDTH, Y_MID + HALF_TLB_SIZE - 1)
+    bottom = (X_MID - HALF_TLB_SIZE + 1, Y_MID + HALF_TLB_SIZE - LWIDTH,
+              X_MID + HALF_TLB_SIZE - 1, Y_MID + HALF_TLB_SIZE + LWIDTH)
+    left = (X_MID - HALF_TLB_SIZE - LWIDTH, Y_MID - HALF_TLB_SIZE + 1,
+            X_MID - HALF_TLB_SIZE + LWIDTH, Y_MID + HALF_TLB_SIZE - 1)
+
+    X, Y, A = X_MID, Y_MID, HALF_TLB_SIZE
+    box = (X - A, Y - A, X + A + 1, Y + A + 1)
+    return dict(zip('TRBL', (top, right, bottom, left))), box
+
+
+def arrow(width: int, height: int,
+          pside: str, p_ind: int, cside: str, c_ind: int) -> tuple[int, ...]:
+    X_MID, Y_MID = mids(width, height)
+
+    P_SHIFT = (ROAD_WIDTH + 1)*(p_ind + 1) - ROAD_WIDTH // 2
+    C_SHIFT = (ROAD_WIDTH + 1)*(c_ind + 1) - ROAD_WIDTH // 2
+
+    x, y, x1, y1 = [ROAD_PAD_XY for _ in '1234']
+    match pside:
+        case 'T':
+            x += P_SHIFT
+        case 'R':
+            x = 2*X_MID - x
+            y += P_SHIFT
+        case 'B':
+            x = 2*X_MID - x - P_SHIFT
+            y = 2*Y_MID - y
+        case 'L':
+            y = 2*Y_MID - y - P_SHIFT
+    match cside:
+        case 'T':
+            x1 = 2*X_MID - x1 - C_SHIFT
+        case 'R':
+            x1 = 2*X_MID - x1
+            y1 = 2*Y_MID - y1 - C_SHIFT
+        case 'B':
+            x1 += C_SHIFT
+            y1 = 2*Y_MID - y1
+        case 'L':
+            y1 += C_SHIFT
+    return x, y, x1, y1
+
+
+def moving_arrow(coords: tuple[int, ...], t: float) -> tuple[float, ...]:
+    # arrow of a car with `t` share of its passing time left
+    x, y, x1, y1 = coords
+    return x*t + x1*(1-t), y*t + y1*(1-t), x1, y1
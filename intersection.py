@@ -9,9 +9,14 @@ class Intersection:
     exit_road_cleared: Event[ConsumerRoad]
     wave_arrived: Event[ProducerRoad]
     car_entered_intersection: Event[tuple[ProducerRoad, ConsumerRoad]]
+    car_waited: Event[tuple[ProducerRoad, float]]
 
     def __init__(self, width: int, height: int, light_type: type[TrafficLight],
-                 laws: dict[str, list[TrafficFlowLaw]] = None):
+                 laws: dict[str, list[TrafficFlowLaw]] = None,
+                 turn_probabilities: dict[str, ApproachTurnProbabilities]
+                 = None,
+                 seed: int = None,
+                 fluid_threshold: int = None):
         self.width = width
         self.height = height
 
@@ -33,6 +38,14 @@ class Intersection:
                 for side in 'LR'
             }
 
+        # a seeded intersection draws from its own generator, the laws given
+        # to it are switched to that generator too
+        rng = Random(seed) if seed is not None else None
+        if rng:
+            for law_side in laws.values():
+                for law in law_side:
+                    law._r = rng
+
         self.roads: dict[str, IntersectionSideInfo] = {
             side: (
                 [
@@ -60,21 +73,52 @@ class Intersection:
         for prods, consumers in self.roads.values():
             [ev.wave_arrived.subscribe(self.wave_arrived)
              or ev.car_entered.subscribe(self.car_entered_intersection)
+             or ev.car_waited.subscribe(self.car_waited)
              for ev in prods]
 
             [ev.car_consumed.subscribe(self.exit_road_cleared)
              for ev in consumers]
 
+        self.movements = TurningMovements(self.roads, turn_probabilities, rng)
         for law_side in laws.values():
             for law in law_side:
-                law.road_info = self.roads
+                law.movements = self.movements
+
+        self.occupancy = IntersectionOccupancy(self.roads, self.movements,
+                                               self.crosswalk_freed,
+                                               self.crosswalk_occupied)
+        for prods, _ in self.roads.values():
+            for prod in prods:
+                prod.occupancy = self.occupancy
+                prod.fluid_threshold = fluid_threshold
 
         traffic_light = light_type(roads=self.roads)
         traffic_light.light_changed += self.light_changed
         self.traffic_light = traffic_light
 
+        # bound ticks of everything in tick order, cached so that a tick in
+        # steady state allocates nothing
+        self._tickers = [traffic_light.tick] + [
+            road.tick
+            for prods, consumers in self.roads.values()
+            for road in prods + consumers
+        ]
+
     def tick(self, dt):
-        self.traffic_light.tick(dt)
-        for side_info in self.roads.values():
-            [prod.tick(dt) for prod in side_info[0]]
-            [prod.tick(dt) for prod in side_info[1]]
+        # indexed loop, iterating would allocate an iterator every tick
+        tickers, i, n = self._tickers, 0, len(self._tickers)
+        while i < n:
+            tickers[i](dt)
+            i += 1
+
+    # there are no pedestrians in the model, crosswalks are only occupied
+    # from outside; while one is, no car starts or ends a movement on its
+    # side (`check_occupancy.py`)
+    def occupy_crosswalk(self, side: str):
+        self.crosswalk_occupied(self.roads[side])
+
+    def free_crosswalk(self, side: str):
+        self.crosswalk_freed(self.roads[side])
+
+    def get_samples(self):
+        return self.traffic_light.get_samples()
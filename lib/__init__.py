@@ -1,8 +1,14 @@
+import warnings
+from collections import deque
 from typing import Literal
 import numpy as np
 
+from .lib_demand import *
 from .lib_event import *
 from .lib_random import *
+from .lib_sketch import *
+from .lib_state import *
+from .lib_stats import *
 from .lib_timer import *
 
 
@@ -11,6 +17,17 @@ OPT_LIGHT_AVERAGING_DUR = 50
 LIGHT_CYCLE_DUR = 120
 OPT_LIGHT_HISTORY_SIZE = 150
 
+# hybrid lanes: discrete cars kept at the head of a fluid queue, and the most
+# cars a single segment of the fluid arrival curve may stand for
+FLUID_HEAD_CARS = 8
+FLUID_SEGMENT_CARS = 64
+
+# light phases in the order a light cycles through them: L/R green, T/B green
+LIGHT_PHASES = (
+    {'T': 'R', 'B': 'R', 'L': 'G', 'R': 'G'},
+    {'T': 'G', 'B': 'G', 'L': 'R', 'R': 'R'},
+)
+
 
 def clamp(mn, mx, v): return min(mx, max(mn, v))
 
@@ -39,6 +56,10 @@ class Tickable:
 TrafficLightColor = Literal['R', 'Y', 'G']
 LightChangedEventArgs = dict[str, TrafficLightColor]
 IntersectionSideInfo = tuple[list['ProducerRoad'], list['ConsumerRoad']]
+TurnType = Literal['right', 'straight', 'left']
+TurnProbabilities = dict[TurnType, float]
+# one set for every lane of an approach, or one per lane
+ApproachTurnProbabilities = TurnProbabilities | list[TurnProbabilities]
 CrosswalkEvent = Event[IntersectionSideInfo]
 
 
@@ -59,17 +80,229 @@ class Road(Tickable):
 
 
 class Car:
-    __slots__ = ['destination', '_time_to_pass']
+    __slots__ = ['destination', '_time_to_pass', 'arrived_at']
     destination: 'ConsumerRoad'
 
-    def __init__(self, destination: Road, time_to_pass: float) -> None:
+    def __init__(self, destination: Road, time_to_pass: float,
+                 arrived_at: float = 0.0) -> None:
         self.destination = destination
         self._time_to_pass = time_to_pass
+        # sim time the car joined the producer road queue
+        self.arrived_at = arrived_at
 
     def get_intersection_pass_duration(self):
         return self._time_to_pass
 
 
+class TurningMovements:
+    # consumer side reached from a producer side by each turn
+    _TURN_SIDES: dict[TurnType, dict[str, str]] = {
+        'right': dict(map(tuple, ('TL', 'BR', 'LB', 'RT'))),
+        'straight': dict(map(tuple, ('TB', 'BT', 'LR', 'RL'))),
+        'left': dict(map(tuple, ('TR', 'BL', 'LT', 'RB'))),
+    }
+
+    def __init__(self,
+                 roads: dict[str, IntersectionSideInfo],
+                 turn_probabilities: dict[str, ApproachTurnProbabilities]
+                 = None,
+                 rng: Random = None):
+        # Probabilities are per lane: turn_probabilities[side] is either
+        # used by every lane of the approach or a list with one entry per
+        # lane, lane 0 being the rightmost. A lane picks among the turns it
+        # can make (only lane 0 turns right, only the last one turns left,
+        # the others go straight) by their weights, and a turn's weight is
+        # split evenly among the exits it reaches. The split over a whole
+        # approach then follows from the lane volumes, it is not enforced.
+        # By default every reachable exit is equally likely
+        turn_probabilities = turn_probabilities or {}
+        self.movements: list[tuple[ProducerRoad, ConsumerRoad]] = []
+        self._tables: dict[ProducerRoad, AliasTable[ConsumerRoad]] = {}
+
+        for side, (prods, _) in roads.items():
+            probs = turn_probabilities.get(side)
+            per_lane = isinstance(probs, list)
+            if per_lane and len(probs) != len(prods):
+                raise Exception(f"Approach {side} has {len(prods)} lanes, "
+                                f"got turn probabilities for {len(probs)}")
+            for i, road in enumerate(prods):
+                turns = self._available_roads(roads, i, side)
+                weights = self._lane_weights(
+                    f"{side}{i}", turns, probs[i] if per_lane else probs,
+                    per_lane
+                )
+                pairs = [
+                    (weights[turn]/len(consumers), consumer)
+                    for turn, consumers in turns.items()
+                    if weights[turn] > 0
+                    for consumer in consumers
+                ]
+                self._tables[road] = AliasTable(pairs, rng)
+                self.movements += [(road, cons) for _, cons in pairs]
+
+    def _lane_weights(self, lane: str,
+                      turns: dict[TurnType, list['ConsumerRoad']],
+                      probs: TurnProbabilities,
+                      strict: bool) -> dict[TurnType, float]:
+        # weight of every turn the lane can make; turns it can not make are
+        # only allowed in the probabilities shared by a whole approach
+        if probs is None:
+            return {turn: float(len(consumers))
+                    for turn, consumers in turns.items()}
+        for turn, weight in probs.items():
+            if turn not in self._TURN_SIDES:
+                raise Exception(f"Unknown turn '{turn}' for lane {lane}")
+            if weight < 0:
+                raise Exception(f"Negative probability of turning {turn} "
+                                f"for lane {lane}")
+            if strict and weight > 0 and turn not in turns:
+                raise Exception(f"Lane {lane} can not turn {turn}, it can "
+                                f"only turn {', '.join(turns)}")
+        weights = {turn: probs.get(turn, 0) for turn in turns}
+        if sum(weights.values()) <= 0:
+            raise Exception(f"Lane {lane} can only turn {', '.join(turns)}, "
+                            f"which get no probability")
+        return weights
+
+    def _available_roads(self, roads: dict[str, IntersectionSideInfo],
+                         i: int, side: str
+                         ) -> dict[TurnType, list['ConsumerRoad']]:
+        res = {}
+        # allow right turn if rightmost
+        # can always go up if not rightmost
+        # allow left turn if leftmost
+        if i == 0:
+            res['right'] = [roads[self._TURN_SIDES['right'][side]][1][i]]
+        else:
+            res['straight'] = roads[self._TURN_SIDES['straight'][side]][1][1:]
+        if i == len(roads[side][0]) - 1:
+            res['left'] = [roads[self._TURN_SIDES['left'][side]][1][-1]]
+        return res
+
+    def destinations(self, road: 'ProducerRoad') -> list['ConsumerRoad']:
+        return self._tables[road].items
+
+    def probabilities(self, road: 'ProducerRoad'
+                      ) -> list[tuple['ConsumerRoad', float]]:
+        table = self._tables[road]
+        return list(zip(table.items, table.probabilities))
+
+    def sample(self, road: 'ProducerRoad') -> 'ConsumerRoad':
+        return self._tables[road].sample()
+
+    def sample_many(self, road: 'ProducerRoad',
+                    count: int) -> list['ConsumerRoad']:
+        return self._tables[road].sample_many(count)
+
+
+def _segments_cross(a: tuple[float, ...], b: tuple[float, ...]) -> bool:
+    def orientation(x, y, x1, y1, x2, y2):
+        return (x1 - x)*(y2 - y) - (y1 - y)*(x2 - x)
+
+    ax, ay, ax1, ay1 = a
+    bx, by, bx1, by1 = b
+    return orientation(ax, ay, ax1, ay1, bx, by) \
+        * orientation(ax, ay, ax1, ay1, bx1, by1) < 0 \
+        and orientation(bx, by, bx1, by1, ax, ay) \
+        * orientation(bx, by, bx1, by1, ax1, ay1) < 0
+
+
+class IntersectionOccupancy:
+    # Every movement (producer, consumer) and every crosswalk owns a bit of
+    # `_occupied`; a movement is admitted when none of the bits it conflicts
+    # with (crossing paths, same exit, crosswalks on its way) is set. Each
+    # movement also counts its set conflicting bits, so that `try_enter`
+    # does no arithmetic on the mask, which allocates once it is large
+    def __init__(self,
+                 roads: dict[str, IntersectionSideInfo],
+                 movements: TurningMovements,
+                 crosswalk_freed: CrosswalkEvent,
+                 crosswalk_occupied: CrosswalkEvent):
+        width, height = len(roads['T'][0]), len(roads['L'][0])
+        pairs = movements.movements
+        paths = [self._path(prod, cons, width, height)
+                 for prod, cons in pairs]
+        self._crosswalk_bits = {
+            side: len(pairs) + i for i, side in enumerate('TRBL')
+        }
+
+        # [bit, conflicting bits set] of every movement, and the movements
+        # every bit conflicts with
+        self._movements: dict[ProducerRoad, dict[ConsumerRoad, list]] = {}
+        self._blocks: list[list[list]] = [[] for _ in range(len(pairs) + 4)]
+        for i, (prod, cons) in enumerate(pairs):
+            conflicts = [self._crosswalk_bits[prod.side],
+                         self._crosswalk_bits[cons.side]]
+            # an exit takes one car at a time, whatever lane it comes from
+            # (the movement itself included); paths of the same lane start
+            # at the same point and only count when they share the exit
+            for j, (other_prod, other_cons) in enumerate(pairs):
+                if other_cons is cons or other_prod is not prod \
+                        and _segments_cross(paths[i], paths[j]):
+                    conflicts.append(j)
+            entry = [i, 0]
+            self._movements.setdefault(prod, {})[cons] = entry
+            for j in conflicts:
+                self._blocks[j].append(entry)
+
+        self._occupied = 0
+        self._active: dict[ConsumerRoad, int] = {}
+        for _, conss in roads.values():
+            for cons in conss:
+                cons.car_consumed += self._on_car_consumed
+        crosswalk_freed += self._on_crosswalk_freed
+        crosswalk_occupied += self._on_crosswalk_occupied
+
+    @staticmethod
+    def _path(prod: 'ProducerRoad', cons: 'ConsumerRoad',
+              width: int, height: int) -> tuple[float, ...]:
+        # lanes are 1 unit wide, the same layout `ui.App` draws
+        p, c = prod.pos + 0.5, cons.pos + 0.5
+        x, y = {
+            'T': (p, 0),
+            'R': (2*width, p),
+            'B': (2*width - p, 2*height),
+            'L': (0, 2*height - p)
+        }[prod.side]
+        x1, y1 = {
+            'T': (2*width - c, 0),
+            'R': (2*width, 2*height - c),
+            'B': (c, 2*height),
+            'L': (0, c)
+        }[cons.side]
+        return x, y, x1, y1
+
+    def try_enter(self, prod: 'ProducerRoad', cons: 'ConsumerRoad') -> bool:
+        bit, blocked = self._movements[prod][cons]
+        if blocked:
+            return False
+        self._set(bit)
+        self._active[cons] = bit
+        return True
+
+    def _set(self, bit: int):
+        if not self._occupied >> bit & 1:
+            self._occupied |= 1 << bit
+            for entry in self._blocks[bit]:
+                entry[1] += 1
+
+    def _clear(self, bit: int):
+        if self._occupied >> bit & 1:
+            self._occupied &= ~(1 << bit)
+            for entry in self._blocks[bit]:
+                entry[1] -= 1
+
+    def _on_car_consumed(self, cons: 'ConsumerRoad'):
+        if cons in self._active:
+            self._clear(self._active.pop(cons))
+
+    def _on_crosswalk_occupied(self, data: IntersectionSideInfo):
+        self._set(self._crosswalk_bits[(data[0] or data[1])[0].side])
+
+    def _on_crosswalk_freed(self, data: IntersectionSideInfo):
+        self._clear(self._crosswalk_bits[(data[0] or data[1])[0].side])
+
+
 class TrafficFlowLaw:
     _r = Random()
 
@@ -81,62 +314,62 @@ class TrafficFlowLaw:
                  max_delay: float,
                  min_time_on_intersec: float,
                  max_time_on_intersec: float,
+                 profile: DemandProfile = None
                  ) -> None:
         self._max_cars = max_cars
         self._mean = avg_car_count / max_cars
+        # overrides lambda_ and avg_car_count with time-varying ones
+        self.profile = profile
 
         self._lambda = lambda_
         self._min_delay = min_delay
         self._max_delay = max_delay
-        self._consumers: list[ConsumerRoad] = []
-        self._consumers_for = {}
+        self.movements: TurningMovements = None
         self._min_time_on_intersec = min_time_on_intersec
         self._intersec_span = max_time_on_intersec - min_time_on_intersec
 
     @property
     def time_to_pass_intersection(self):
         # float in range [min_time_on_intersec; max_time_on_intersec]
-        return r.random()*self._intersec_span + self._min_time_on_intersec
+        return self._r.random()*self._intersec_span \
+            + self._min_time_on_intersec
 
     @property
     def road_info(self): raise Exception("Readonly property")
 
     @road_info.setter
     def road_info(self, value: dict[str, IntersectionSideInfo]):
-        def available_roads(i: int, side: str):
-            mpp = lambda *xs: dict(map(tuple, xs))
-            res = []
-            # allow right turn if rightmost
-            # can always go up if not rightmost
-            # allow left turn if leftmost
-            res += [value[mpp('TL', 'BR', 'LB', 'RT')[side]][1][i]] \
-                if i == 0 \
-                else value[mpp('TB', 'BT', 'LR', 'RL')[side]][1][1:]
-            if i == len(value[side][0]) - 1:
-                res += [value[mpp('TR', 'BL', 'LT', 'RB')[side]][1][-1]]
-            return res
-
-        self._consumers = value
-        self._consumers_for = {
-            side: {
-                road: available_roads(i, road.side)
-                for i, road in enumerate(value[side][0])
-            }
-            for side in value
-        }
+        # standalone laws only, an `Intersection` shares one table among all
+        # of its laws through `movements`
+        self.movements = TurningMovements(value)
+
+    def wave_size(self, t: float = 0) -> int:
+        mean = self._mean if self.profile is None \
+            else self.profile.avg_car_count(t)/self._max_cars
+        return self._r.binom_dist(self._max_cars, mean)
 
-    def cars(self, side: str, road: 'ProducerRoad') -> list[Car]:
+    def make_cars(self, road: 'ProducerRoad', count: int,
+                  t: float = 0) -> list[Car]:
         return [
-            Car(r.choice(self._consumers_for[side][road]),
-                self.time_to_pass_intersection)
-            for _ in range(self._r.binom_dist(self._max_cars, self._mean))
+            Car(destination, self.time_to_pass_intersection, t)
+            for destination in self.movements.sample_many(road, count)
         ]
 
+    def cars(self, side: str, road: 'ProducerRoad',
+             t: float = 0) -> list[Car]:
+        return self.make_cars(road, self.wave_size(t), t)
+
     @property
     def wave_delay(self):
         value = self._r.exp_dist(self._lambda)
         return clamp(self._min_delay, self._max_delay, value)
 
+    def next_wave_delay(self, t: float) -> float:
+        if self.profile is None:
+            return self.wave_delay
+        value = self.profile.next_arrival(t, self._r.exp_dist(1)) - t
+        return clamp(self._min_delay, self._max_delay, value)
+
 
 @with_event_handlers_init
 class TrafficLight(Tickable):
@@ -156,20 +389,48 @@ class TrafficLight(Tickable):
 
         self._wait_times: np.ndarray = np.full((4, 1), -1)
         self._drop_waiting_amounts()
+        # car-seconds spent waiting since the start, never dropped
+        self.total_waiting = 0.0
+        self.history_size = OPT_LIGHT_HISTORY_SIZE
 
         self._h_time = LIGHT_CYCLE_DUR/2
         self._v_time = LIGHT_CYCLE_DUR/2
         self._time_until_next_avg = OPT_LIGHT_AVERAGING_DUR
-        self._time_until_optim = 60
-
-        self.time_until_switch = 0
-        self.states = self.states_iterator()
+        self._time_until_optim = 60.0
+
+        self.time_until_switch = 0.0
+        # tick allocates nothing in steady state: the phase tables are built
+        # once, queued cars are recounted only when a queue changes
+        self._phase = len(LIGHT_PHASES) - 1
+        self._phase_states = tuple(
+            {side: state[side] for side in self.roads}
+            for state in LIGHT_PHASES
+        )
+        self._h_roads = self.roads['L'][0] + self.roads['R'][0]
+        self._v_roads = self.roads['T'][0] + self.roads['B'][0]
+        self._h_cars = self._v_cars = 0
+        self._counted: dict[ProducerRoad, int] = {}
+        for road in self._h_roads + self._v_roads:
+            self._counted[road] = road.car_count
+            road.wave_arrived += self._recount
+            road.car_entered += self._on_car_entered
 
     def get_samples(self):
         return self._wait_times
 
     def _drop_waiting_amounts(self):
-        self._cur_waiting_amounts = [0, 0]
+        self._cur_waiting_amounts = [0.0, 0.0]
+
+    def _recount(self, road: 'ProducerRoad'):
+        delta = road.car_count - self._counted[road]
+        self._counted[road] = road.car_count
+        if road.side in 'LR':
+            self._h_cars += delta
+        else:
+            self._v_cars += delta
+
+    def _on_car_entered(self, args: tuple['ProducerRoad', 'ConsumerRoad']):
+        self._recount(args[0])
 
     def get_durations(self):
         return self._h_time, self._v_time
@@ -179,23 +440,21 @@ class TrafficLight(Tickable):
     def tick(self, dt):
         self.time_until_switch -= dt
         if self.time_until_switch <= 0:
-            state, time_until_switch = next(self.states)
+            self._phase = (self._phase + 1) % len(LIGHT_PHASES)
             # keeping previous negative timing
-            self.time_until_switch += time_until_switch
-            self.light_changed({side: state[side] for side in self.roads})
+            self.time_until_switch += \
+                self._h_time if self._phase == 0 else self._v_time
+            self.light_changed(self._phase_states[self._phase])
 
-        sums = {
-            side: sum(road.car_count for road in roads)
-            for side, (roads, _) in self.roads.items()
-        }
-        self._cur_waiting_amounts[0] += dt*(sums['L'] + sums['R'])
-        self._cur_waiting_amounts[1] += dt*(sums['T'] + sums['B'])
+        self._cur_waiting_amounts[0] += dt*self._h_cars
+        self._cur_waiting_amounts[1] += dt*self._v_cars
+        self.total_waiting += dt*self._h_cars + dt*self._v_cars
 
         self._time_until_optim -= dt
         if self._time_until_optim <= 0:
             self.optimize()
             if self._time_until_optim <= 0:
-                self._time_until_optim = 60
+                self._time_until_optim = 60.0
 
         self._time_until_next_avg -= dt
         if self._time_until_next_avg > 0:
@@ -210,17 +469,13 @@ class TrafficLight(Tickable):
 
         if waits.shape[1] == 1 and waits[0, 0] == -1:
             waits[:, 0] = [X, H, V, A]
-        elif waits.shape[1] == OPT_LIGHT_HISTORY_SIZE:
-            waits = np.roll(waits, -1, 1)
+        elif waits.shape[1] >= self.history_size:
+            waits = np.roll(waits[:, -self.history_size:], -1, 1)
             waits[:, -1] = [X, H, V, A]
         else:
             waits = np.append(waits, [[X], [H], [V], [A]], 1)
         self._wait_times = waits
 
-    def states_iterator(self) -> tuple[dict[str, TrafficLightColor], float]:
-        while True:
-            yield ({'T': 'R', 'B': 'R', 'L': 'G', 'R': 'G'}, self._h_time)
-            yield ({'T': 'G', 'B': 'G', 'L': 'R', 'R': 'R'}, self._v_time)
 
 @with_event_handlers_init
 class ConsumerRoad(Road):
@@ -259,7 +514,8 @@ class ConsumerRoad(Road):
             self._is_blocked = False
 
     def tick(self, dt: float):
-        if not self.is_busy:
+        # `is_busy` inlined, most exits are idle most of the time
+        if self.upcoming_car is None:
             return
 
         self._duration_left_for_car -= dt
@@ -275,6 +531,8 @@ class ConsumerRoad(Road):
 class ProducerRoad(Road):
     wave_arrived: Event['ProducerRoad']
     car_entered: Event[tuple['ProducerRoad', 'ConsumerRoad']]
+    # time the car spent in the queue
+    car_waited: Event[tuple['ProducerRoad', float]]
 
     def __init__(self,
                  side: str,
@@ -289,30 +547,66 @@ class ProducerRoad(Road):
         self.side = side
         self.pos = pos
         self.timeout = 0
+        self.current_light: TrafficLightColor = 'R'
+        self._green = False
         traffic_light_changed += self._on_traffic_light_changed
         self.car_prod_law = car_production_law
         self.cars: list[Car] = []
         self._car_on_inters: Car = None
-        self._t_until_wave = car_production_law.wave_delay
+        self._time = 0.0
+        self._t_until_wave = car_production_law.next_wave_delay(0.0)
+        self.occupancy: IntersectionOccupancy = None
+
+        # Hybrid mode: once more than `fluid_threshold` cars wait, all but
+        # the FLUID_HEAD_CARS first ones are only counted, as segments
+        # [first arrival, last arrival, cars] of the cumulative arrival
+        # curve; cars get a destination when they reach the head. Back to
+        # discrete cars when the queue is under half the threshold
+        self.fluid_threshold: int = None
+        self._fluid: deque[list] = deque()
+        self._fluid_count = 0
+
+        # cars arriving to a queue of `max_queue` cars turn away
+        self.max_queue: int = None
+        self.dropped_cars = 0
 
     def _on_traffic_light_changed(self, args: LightChangedEventArgs):
-        self.current_light = args[self.side]
-
-    def tick(self, dt: float):
-        self._update_incoming_cars(dt)
-        match self.current_light:
-            case 'R' | 'Y':
-                pass
-            case 'G':
-                self._green_light_tick(dt)
+        match args[self.side]:
+            case 'R' | 'Y' | 'G' as v:
+                self.current_light = v
+                self._green = v == 'G'
             case v: raise Exception(f"Unexpected light '{v}'")
 
-    def _update_incoming_cars(self, dt: float):
+    def tick(self, dt: float):
+        # calls only when there is something to do, most ticks have no wave
+        # and many lanes no queue
         if self._t_until_wave <= 0:
-            self._t_until_wave += self.car_prod_law.wave_delay
-            self.cars += self.car_prod_law.cars(self.side, self)
-            self.wave_arrived(self)
+            self._update_incoming_cars()
         self._t_until_wave -= dt
+        self._time += dt
+        if self._green and self.cars:
+            self._green_light_tick(dt)
+
+    def _update_incoming_cars(self):
+        arrived_at = self._time + self._t_until_wave
+        law = self.car_prod_law
+        self._t_until_wave += law.next_wave_delay(arrived_at)
+        count = law.wave_size(arrived_at)
+        if self.max_queue is not None \
+                and self.car_count + count > self.max_queue:
+            allowed = max(0, self.max_queue - self.car_count)
+            self._drop_cars(count - allowed)
+            count = allowed
+        if self._fluid_count or self.fluid_threshold is not None \
+                and len(self.cars) + count > self.fluid_threshold:
+            if not self._fluid_count:
+                self._to_fluid()
+            self._add_fluid(count, arrived_at)
+            # the head may be empty, cars only leave from it
+            self._drain_fluid()
+        else:
+            self.cars += law.make_cars(self, count, arrived_at)
+        self.wave_arrived(self)
 
     def _green_light_tick(self, dt: float):
         if not self.cars:
@@ -323,14 +617,82 @@ class ProducerRoad(Road):
             return
 
         destination = self.cars[0].destination
-        if not destination.is_busy:
-            destination.accept(self.cars.pop(0))
+        if self.occupancy is None:
+            admitted = not destination.is_busy
+        else:
+            admitted = self.occupancy.try_enter(self, destination)
+        if admitted:
+            car = self.cars.pop(0)
+            destination.accept(car)
             self.timeout = PRODUCER_ROAD_PASS_TIMEOUT
             self.car_entered((self, destination))
+            self.car_waited((self, self._time - car.arrived_at))
+            if self._fluid_count:
+                self._drain_fluid()
+
+    def _drop_cars(self, count: int):
+        if not self.dropped_cars:
+            warnings.warn(f"Queue of producer road {self.side}{self.pos} hit "
+                          f"its cap of {self.max_queue} cars, arriving cars "
+                          f"are dropped")
+        self.dropped_cars += count
+
+    def _to_fluid(self):
+        # switching to the hybrid mode: cars behind the head only keep
+        # their arrival times
+        tail = self.cars[FLUID_HEAD_CARS:]
+        del self.cars[FLUID_HEAD_CARS:]
+        for car in tail:
+            self._add_fluid(1, car.arrived_at)
+
+    def _add_fluid(self, count: int, t: float):
+        if not count:
+            return
+        self._fluid_count += count
+        last = self._fluid[-1] if self._fluid else None
+        if last and last[2] + count <= FLUID_SEGMENT_CARS:
+            last[1] = t
+            last[2] += count
+        else:
+            self._fluid.append([t, t, count])
+
+    def _take_fluid(self, count: int) -> list[Car]:
+        # cars leave the fluid part in order, arrival times are interpolated
+        # along the segment they belonged to
+        res = []
+        while count and self._fluid:
+            segment = self._fluid[0]
+            first, last, cars = segment
+            taken = min(count, cars)
+            step = (last - first)/cars
+            res += [
+                Car(destination, self.car_prod_law.time_to_pass_intersection,
+                    first + i*step)
+                for i, destination in enumerate(
+                    self.car_prod_law.movements.sample_many(self, taken)
+                )
+            ]
+            if taken == cars:
+                self._fluid.popleft()
+            else:
+                segment[0] = first + taken*step
+                segment[2] -= taken
+            count -= taken
+            self._fluid_count -= taken
+        return res
+
+    def _drain_fluid(self):
+        # a lane whose threshold was lifted goes back to discrete cars
+        if self.fluid_threshold is None \
+                or self._fluid_count + len(self.cars) \
+                <= self.fluid_threshold // 2:
+            self.cars += self._take_fluid(self._fluid_count)
+        elif len(self.cars) < FLUID_HEAD_CARS:
+            self.cars += self._take_fluid(FLUID_HEAD_CARS - len(self.cars))
 
     @property
     def car_count(self):
-        return len(self.cars)
+        return len(self.cars) + self._fluid_count
 
     def _on_occupied(self, data: IntersectionSideInfo):
         if self in data[0]:
@@ -0,0 +1,114 @@
+import math as m
+from bisect import bisect_right
+
+
+_MAX_BUCKETS = 1 << 16
+
+
+def _bucket_table(bounds: list[float], step: float, end: float) -> list[int]:
+    # index of the segment every `step`-wide bucket of [0; end) starts in,
+    # so that a lookup is a division and at most a couple of comparisons
+    count = min(_MAX_BUCKETS, int(end/step) + 1)
+    return [bisect_right(bounds, b*step) - 1 for b in range(count)]
+
+
+class DemandProfile:
+    # Piecewise-constant wave intensity `lambda_` and mean wave size
+    # `avg_car_count`; segment i lasts from starts[i] to starts[i + 1]
+    # (the last one forever, or until `period` after which it all repeats).
+    # Arrivals are sampled by inverting the cumulative intensity
+    def __init__(self,
+                 starts: list[float],
+                 lambdas: list[float],
+                 avg_car_counts: list[float],
+                 period: float = None):
+        if not (len(starts) == len(lambdas) == len(avg_car_counts)) \
+                or not starts or starts[0] != 0:
+            raise Exception("Profile segments must start at 0 and have "
+                            "an intensity and a car count each")
+        if any(a >= b for a, b in zip(starts, starts[1:])):
+            raise Exception("Profile segment starts must be increasing")
+        if period is not None and period <= starts[-1]:
+            raise Exception("Profile period must cover all the segments")
+        if any(lam < 0 for lam in lambdas):
+            raise Exception("Profile intensities must be non-negative")
+
+        self._starts = list(starts)
+        self._lambdas = list(lambdas)
+        self._avg_car_counts = list(avg_car_counts)
+        self._period = period
+
+        ends = self._starts[1:] + ([period] if period is not None else [])
+        self._cum = [0.0]
+        for start, end, lam in zip(self._starts, ends, self._lambdas):
+            self._cum.append(self._cum[-1] + lam*(end - start))
+        self._total = self._cum[-1] if period is not None else m.inf
+        if period is not None and self._total == 0:
+            raise Exception("Periodic profile must have a positive intensity")
+
+        lengths = [end - start for start, end in zip(self._starts, ends)]
+        self._t_step = min(lengths, default=1.0)
+        self._t_buckets = _bucket_table(
+            self._starts, self._t_step, ends[-1] if ends else 0
+        )
+        increments = [b - a for a, b in zip(self._cum, self._cum[1:]) if b > a]
+        self._cum_step = min(increments, default=1.0)
+        self._cum_buckets = _bucket_table(
+            self._cum[:len(self._starts)], self._cum_step, self._cum[-1]
+        )
+
+    @classmethod
+    def from_table(cls, rows: list[tuple[float, float, float]],
+                   period: float = None) -> 'DemandProfile':
+        # rows of (start, lambda_, avg_car_count)
+        starts, lambdas, counts = zip(*rows)
+        return cls(list(starts), list(lambdas), list(counts), period)
+
+    @property
+    def segments(self) -> list[tuple[float, float, float]]:
+        # (start, lambda_, avg_car_count) rows, as taken by `from_table`
+        return list(zip(self._starts, self._lambdas, self._avg_car_counts))
+
+    def _segment(self, t: float) -> int:
+        i = self._t_buckets[min(int(t/self._t_step), len(self._t_buckets) - 1)]
+        while i + 1 < len(self._starts) and self._starts[i + 1] <= t:
+            i += 1
+        return i
+
+    def _segment_of_integral(self, y: float) -> int:
+        buckets = self._cum_buckets
+        i = buckets[min(int(y/self._cum_step), len(buckets) - 1)]
+        while i + 1 < len(self._starts) and self._cum[i + 1] <= y:
+            i += 1
+        return i
+
+    def _wrap(self, t: float) -> tuple[float, float]:
+        if self._period is None:
+            return 0, t
+        return divmod(t, self._period)
+
+    def lambda_(self, t: float) -> float:
+        return self._lambdas[self._segment(self._wrap(t)[1])]
+
+    def avg_car_count(self, t: float) -> float:
+        return self._avg_car_counts[self._segment(self._wrap(t)[1])]
+
+    def intensity_integral(self, t: float) -> float:
+        cycles, t = self._wrap(t)
+        i = self._segment(t)
+        return (cycles*self._total if cycles else 0.0) + self._cum[i] \
+            + self._lambdas[i]*(t - self._starts[i])
+
+    def inverse_integral(self, y: float) -> float:
+        cycles, base = 0, 0.0
+        if self._period is not None:
+            cycles, y = divmod(y, self._total)
+            base = cycles*self._period
+        i = self._segment_of_integral(y)
+        if self._lambdas[i] == 0:
+            return m.inf
+        return base + self._starts[i] + (y - self._cum[i])/self._lambdas[i]
+
+    def next_arrival(self, t: float, exp_sample: float) -> float:
+        # time of the next event after `t`, given an Exp(1) sample
+        return self.inverse_integral(self.intensity_integral(t) + exp_sample)
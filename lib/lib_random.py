@@ -1,7 +1,7 @@
 import math as m
 import random as r
 
-from typing import TypeVar
+from typing import TypeVar, Generic
 
 _T = TypeVar('_T')
 
@@ -9,8 +9,15 @@ _T = TypeVar('_T')
 class Random:
     _binom_tables = {}
 
+    def __init__(self, seed: int = None) -> None:
+        # own generator when seeded, the shared `random` module otherwise
+        self._gen = None if seed is None else r.Random(seed)
+
+    def random(self) -> float:
+        return r.random() if self._gen is None else self._gen.random()
+
     def exp_dist(self, lambda_: float) -> float:
-        return -m.log(1 - r.random()) / lambda_
+        return -m.log(1 - self.random()) / lambda_
 
     def binom_dist(self, n: int, p: float) -> int:
         if (n, p) in self._binom_tables:
@@ -19,7 +26,7 @@ class Random:
             table = self._generate_table(n, p)
             self._binom_tables[(n, p)] = table
 
-        X = r.random()
+        X = self.random()
         return next(v for v, p in table if X > p) + 1
 
     def _generate_table(self, n: int, p: float) -> list[tuple[int, float]]:
@@ -39,7 +46,7 @@ class Random:
 
     def weightened_choice(self, pairs: list[tuple[float, _T]]) -> _T:
         w = sum(w for w, _ in pairs)
-        p = int(r.random()*w)
+        p = self.random()*w
         for p1, item in pairs:
             if p >= p1:
                 p -= p1
@@ -48,6 +55,42 @@ class Random:
         raise Exception
 
 
+# Walker's alias method: O(n) to build, O(1) and one random number per sample
+class AliasTable(Generic[_T]):
+    def __init__(self, pairs: list[tuple[float, _T]], rng: Random = None):
+        total = sum(w for w, _ in pairs)
+        if not pairs or total <= 0:
+            raise Exception("Weights must have a positive sum")
+
+        n = len(pairs)
+        scaled = [w*n/total for w, _ in pairs]
+        prob = [1.0]*n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+        self.items = [item for _, item in pairs]
+        self.probabilities = [w/total for w, _ in pairs]
+        self._random = rng.random if rng else r.random
+        self._n = n
+        self._prob = prob
+        self._alias_items = [self.items[i] for i in alias]
+
+    def sample(self) -> _T:
+        u = self._random()*self._n
+        i = int(u)
+        return self.items[i] if u - i < self._prob[i] else self._alias_items[i]
+
+    def sample_many(self, count: int) -> list[_T]:
+        sample = self.sample
+        return [sample() for _ in range(count)]
+
+
 if __name__ == '__main__':
     a = Random()
 
@@ -0,0 +1,76 @@
+import math as m
+import random as r
+
+
+# KLL streaming quantile sketch: level h keeps items of weight 2**h, a full
+# level is sorted and every other item (random offset) is promoted.
+# Memory is O(k) no matter how many items were added, rank error ~ 1/k;
+# sketches of separate streams can be merged. The offsets come from the
+# sketch's own generator, tracking a run must not change it
+class KLLSketch:
+    def __init__(self, k: int = 200, c: float = 2/3, seed: int = None) -> None:
+        self.k = k
+        self._c = c
+        self._r = r.Random(seed)
+        self._levels: list[list[float]] = [[]]
+        self.count = 0
+        self.min = m.inf
+        self.max = -m.inf
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, m.ceil(self.k * self._c**depth))
+
+    def _compress(self):
+        h = 0
+        while h < len(self._levels):
+            level = self._levels[h]
+            if len(level) >= self._capacity(h):
+                if h + 1 == len(self._levels):
+                    self._levels.append([])
+                level.sort()
+                keep = [level.pop()] if len(level) % 2 else []
+                self._levels[h + 1] += level[self._r.randint(0, 1)::2]
+                self._levels[h] = keep
+            h += 1
+
+    def update(self, value: float):
+        self._levels[0].append(value)
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def merge(self, other: 'KLLSketch'):
+        while len(self._levels) < len(other._levels):
+            self._levels.append([])
+        for level, items in zip(self._levels, other._levels):
+            level += items
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def quantiles(self, qs: list[float]) -> list[float]:
+        if not self.count:
+            return [m.nan for _ in qs]
+        items = sorted(
+            (value, 1 << h)
+            for h, level in enumerate(self._levels)
+            for value in level
+        )
+        total = sum(w for _, w in items)
+        res = []
+        for q in qs:
+            target, acc = q*total, 0
+            for value, w in items:
+                acc += w
+                if acc >= target:
+                    break
+            res.append(value)
+        return res
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles([q])[0]
+
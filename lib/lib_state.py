@@ -0,0 +1,141 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+SIDES = 'TRBL'
+LIGHT_COLORS = 'RYG'
+
+# exits[side, pos] = (source side index, source pos, time left, duration,
+#                     serial number of the car); source side is -1 if free
+EXIT_FIELDS = 5
+
+
+# flat array snapshot of an intersection, enough for the UI to draw it
+class ModelState:
+    def __init__(self, width: int, height: int, history_size: int,
+                 buffers: dict[str, memoryview] = None):
+        self.width = width
+        self.height = height
+        for name, (shape, dtype) in self.layout(width, height,
+                                                history_size).items():
+            setattr(self, name,
+                    np.zeros(shape, dtype) if buffers is None
+                    else np.ndarray(shape, dtype, buffer=buffers[name]))
+
+    @staticmethod
+    def layout(width: int, height: int, history_size: int):
+        size = max(width, height)
+        return {
+            # sim time, samples count, cars passed
+            'header': ((3,), np.float64),
+            'lights': ((4,), np.uint8),
+            'queues': ((4, size), np.int32),
+            'exits': ((4, size, EXIT_FIELDS), np.float64),
+            'samples': ((4, history_size), np.float64),
+        }
+
+    def reset(self):
+        self.header[:] = 0
+        self.lights[:] = 0
+        self.queues[:] = 0
+        self.exits[:] = 0
+        self.exits[..., 0] = -1
+        self.samples[:, 0] = -1
+        self.header[1] = 1
+
+    @property
+    def time(self) -> float:
+        return float(self.header[0])
+
+    def light(self, side: str) -> str:
+        return LIGHT_COLORS[self.lights[SIDES.index(side)]]
+
+    def get_samples(self) -> np.ndarray:
+        return self.samples[:, :int(self.header[1])]
+
+    def on_light_changed(self, args: dict[str, str]):
+        for side, color in args.items():
+            self.lights[SIDES.index(side)] = LIGHT_COLORS.index(color)
+
+    def on_car_entered(self, args: tuple):
+        prod, cons = args
+        self.header[2] += 1
+        self.exits[SIDES.index(cons.side), cons.pos] = (
+            SIDES.index(prod.side), prod.pos, cons.consumption_time,
+            cons.consumption_time, self.header[2]
+        )
+
+    def on_exit_cleared(self, cons):
+        self.exits[SIDES.index(cons.side), cons.pos, 0] = -1
+
+    def update(self, time: float, roads: dict, samples: np.ndarray):
+        self.header[0] = time
+        for i, side in enumerate(SIDES):
+            prods, conss = roads[side]
+            for road in prods:
+                self.queues[i, road.pos] = road.car_count
+            for road in conss:
+                self.exits[i, road.pos, 2] = road.consumption_time
+
+        n = samples.shape[1]
+        if n != self.header[1] or samples[0, -1] != self.samples[0, n - 1]:
+            self.samples[:, :n] = samples
+            self.header[1] = n
+
+
+# Named numpy arrays in shared memory blocks: created without `names`
+# allocates (and owns) the blocks, with `names` attaches to the blocks
+# allocated by another process
+class SharedArrays:
+    def __init__(self, layout: dict[str, tuple[tuple[int, ...], type]],
+                 names: dict[str, str] = None):
+        self._owner = names is None
+        self._blocks = {
+            name: shared_memory.SharedMemory(
+                name=None if self._owner else names[name],
+                create=self._owner,
+                size=max(1, int(np.prod(shape))*np.dtype(dtype).itemsize)
+            )
+            for name, (shape, dtype) in layout.items()
+        }
+        for name, (shape, dtype) in layout.items():
+            setattr(self, name, np.ndarray(shape, dtype,
+                                           buffer=self._blocks[name].buf))
+
+    @property
+    def names(self) -> dict[str, str]:
+        return {name: block.name for name, block in self._blocks.items()}
+
+    @property
+    def buffers(self) -> dict[str, memoryview]:
+        return {name: block.buf for name, block in self._blocks.items()}
+
+    def close(self):
+        # array views must be dropped before the buffers can be released
+        for name in self._blocks:
+            setattr(self, name, None)
+        for block in self._blocks.values():
+            block.close()
+            if self._owner:
+                block.unlink()
+
+
+class SharedModelState(ModelState):
+    def __init__(self, width: int, height: int, history_size: int,
+                 names: dict[str, str] = None):
+        self._shared = SharedArrays(
+            self.layout(width, height, history_size), names
+        )
+        super().__init__(width, height, history_size, self._shared.buffers)
+        if names is None:
+            self.reset()
+
+    @property
+    def names(self) -> dict[str, str]:
+        return self._shared.names
+
+    def close(self):
+        for name in self._shared.names:
+            setattr(self, name, None)
+        self._shared.close()
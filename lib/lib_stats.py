@@ -0,0 +1,51 @@
+import math as m
+from statistics import NormalDist
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Interval(NamedTuple):
+    mean: float
+    half_width: float
+
+    @property
+    def relative_precision(self) -> float:
+        return self.half_width / abs(self.mean) if self.mean else m.inf
+
+
+def t_quantile(q: float, dof: int) -> float:
+    # Cornish-Fisher expansion around the normal quantile, accurate enough
+    # for the >= 10 batches confidence intervals are built from
+    z = NormalDist().inv_cdf(q)
+    return z + (z**3 + z)/(4*dof) \
+        + (5*z**5 + 16*z**3 + 3*z)/(96*dof**2) \
+        + (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/(384*dof**3)
+
+
+def mser_truncation(series: np.ndarray, batch: int = 5) -> int:
+    # MSER-m: amount of leading observations to drop as warm-up, chosen to
+    # minimize the standard error of the remaining mean (limited to the
+    # first half of the series, past that the rule is unreliable)
+    n = len(series) // batch
+    if n < 2:
+        return 0
+    means = series[:n*batch].reshape(n, batch).mean(axis=1)
+    tail_len = np.arange(n, 0, -1)
+    tail_sum = np.cumsum(means[::-1])[::-1]
+    tail_sq = np.cumsum((means**2)[::-1])[::-1]
+    sse = tail_sq - tail_sum**2/tail_len
+    mser = sse / tail_len**2
+    return int(np.argmin(mser[:n//2 + 1])) * batch
+
+
+def batch_means(series: np.ndarray, batches: int = 20,
+                confidence: float = 0.95) -> Interval:
+    size = len(series) // batches
+    if size == 0:
+        return Interval(float(np.mean(series)) if len(series) else 0.0, m.inf)
+    means = series[len(series) - size*batches:].reshape(batches, size)\
+        .mean(axis=1)
+    t = t_quantile((1 + confidence)/2, batches - 1)
+    return Interval(float(means.mean()),
+                    t*float(means.std(ddof=1))/m.sqrt(batches))
@@ -1,7 +1,7 @@
 from lib import TrafficLight, TrafficFlowLaw
 from optimized import OptimizingTrafficLight
-from intersection import Intersection
 from ui import App
+from worker import ModelWorker
 
 def main():
 
@@ -36,10 +36,11 @@ def main():
     }
 
 
-    model = Intersection(INTERSECTION_WIDTH, INTERSECTION_HEIGHT,
+    # every compared model ticks on its own core
+    model = ModelWorker(INTERSECTION_WIDTH, INTERSECTION_HEIGHT,
                         OptimizingTrafficLight, get_laws())
-    model2 = Intersection(INTERSECTION_WIDTH, INTERSECTION_HEIGHT,
-                        TrafficLight, get_laws())
+    model2 = ModelWorker(INTERSECTION_WIDTH, INTERSECTION_HEIGHT,
+                         TrafficLight, get_laws())
 
     root = App([model, model2], labels=(
         'Середній сумарний час у світлофора з оптимізацією',
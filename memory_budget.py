@@ -0,0 +1,88 @@
+import sys
+
+from intersection import Intersection
+from lib import Event, OPT_LIGHT_HISTORY_SIZE
+
+
+def _events_of(obj) -> list[Event]:
+    return [v for v in vars(obj).values() if isinstance(v, Event)]
+
+
+def _event_size(event: Event) -> int:
+    return sys.getsizeof(event._subs) \
+        + sum(sys.getsizeof(sub) for sub in event._subs)
+
+
+def _list_size(items: list) -> int:
+    return sys.getsizeof(items) + sum(sys.getsizeof(i) for i in items)
+
+
+def memory_report(model: Intersection) -> dict[str, int]:
+    # approximate bytes held by every component of a running model
+    prods = [p for prods, _ in model.roads.values() for p in prods]
+    conss = [c for _, conss in model.roads.values() for c in conss]
+    light = model.traffic_light
+
+    cars = sum(_list_size(p.cars) for p in prods) + sum(
+        sys.getsizeof(c.upcoming_car) for c in conss if c.upcoming_car
+    )
+    fluid = sum(
+        sys.getsizeof(p._fluid) + sum(_list_size(seg) for seg in p._fluid)
+        for p in prods
+    )
+    tables = sum(
+        _list_size(t.items) + _list_size(t._prob)
+        + _list_size(t.probabilities) + sys.getsizeof(t._alias_items)
+        for t in model.movements._tables.values()
+    ) + _list_size(model.movements.movements)
+    occupancy = sum(
+        sys.getsizeof(by_cons) + sum(_list_size(v) for v in by_cons.values())
+        for by_cons in model.occupancy._movements.values()
+    ) + sum(sys.getsizeof(b) for b in model.occupancy._blocks)
+    events = sum(
+        _event_size(ev)
+        for obj in [model, light, *prods, *conss]
+        for ev in _events_of(obj)
+    )
+    return {
+        'cars': cars,
+        'fluid queues': fluid,
+        'light history': light.get_samples().nbytes,
+        'turning tables': tables,
+        'occupancy': occupancy,
+        'events': events,
+    }
+
+
+# Caps what grows with the run length (light history) and with the load
+# (producer road queues: cars over the cap are dropped with a warning,
+# optionally switching to the hybrid fluid lanes first). Caps left at None
+# keep what the model already has
+class MemoryBudget:
+    def __init__(self,
+                 max_queue: int = None,
+                 history_size: int = OPT_LIGHT_HISTORY_SIZE,
+                 fluid_threshold: int = None):
+        if history_size > OPT_LIGHT_HISTORY_SIZE:
+            raise Exception("History can not exceed OPT_LIGHT_HISTORY_SIZE")
+        self.max_queue = max_queue
+        self.history_size = history_size
+        self.fluid_threshold = fluid_threshold
+
+    def apply(self, model: Intersection):
+        model.traffic_light.history_size = self.history_size
+        for prods, _ in model.roads.values():
+            for road in prods:
+                if self.max_queue is not None:
+                    road.max_queue = self.max_queue
+                if self.fluid_threshold is not None:
+                    road.fluid_threshold = self.fluid_threshold
+
+    def dropped_cars(self, model: Intersection) -> int:
+        return sum(road.dropped_cars
+                   for prods, _ in model.roads.values() for road in prods)
+
+    def report(self, model: Intersection) -> dict[str, int]:
+        return memory_report(model) | {
+            'dropped cars': self.dropped_cars(model)
+        }
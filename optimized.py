@@ -6,8 +6,10 @@ MIN_GREEN_LIGHT = 2
 
 class OptimizingTrafficLight(TrafficLight):
     def optimize(self):
-        summary_h = self._wait_times[1].sum()
-        summary_v = self._wait_times[2].sum()
+        # plain floats, numpy scalars would leak into the phase timings and
+        # allocate on every tick
+        summary_h = float(self._wait_times[1].sum())
+        summary_v = float(self._wait_times[2].sum())
 
         self._time_until_optim = 2*LIGHT_CYCLE_DUR
         if summary_h == 0:
@@ -0,0 +1,289 @@
+import math as m
+from typing import Iterable, NamedTuple
+
+from intersection import Intersection
+from lib import (TrafficFlowLaw, TrafficLight, ProducerRoad,
+                 ApproachTurnProbabilities, SIDES,
+                 PRODUCER_ROAD_PASS_TIMEOUT)
+
+
+# Analytical estimate of a light timing: every producer road is treated as
+# a signalized lane fed by the batch renewal process of its law, with the
+# Webster delay formula (random term scaled by the dispersion of arrivals).
+# The time a lane needs per car comes from the movements it feeds: a car
+# waits for the previous car of its lane when both take the same exit, and
+# for the conflicting movements of the other lanes (shared exits, crossing
+# paths) as `IntersectionOccupancy` admits them
+
+
+class LaneEstimate(NamedTuple):
+    arrival_rate: float     # cars/s
+    capacity: float         # cars/s over the whole light cycle
+    saturation: float       # arrival_rate / capacity
+    mean_wait: float        # s
+    mean_queue: float       # cars
+
+    @property
+    def stable(self):
+        return self.saturation < 1
+
+
+TimingEstimate = dict[str, list[LaneEstimate]]
+
+
+def law_rates(law: TrafficFlowLaw) -> tuple[float, float]:
+    # wave intensity and share of `max_cars` per wave. A law with a demand
+    # profile is taken at its busiest segment: a timing that holds the peak
+    # holds the rest of the profile
+    if law.profile is None:
+        return law._lambda, law._mean
+    return max(
+        ((lam, count/law._max_cars)
+         for _, lam, count in law.profile.segments),
+        key=lambda rates: _arrival_rate(law, *rates)[0]
+    )
+
+
+def wave_delay_moments(law: TrafficFlowLaw,
+                       lam: float = None) -> tuple[float, float]:
+    # first two moments of clamp(min_delay, max_delay, Exp(lambda))
+    lam = law_rates(law)[0] if lam is None else lam
+    lo, hi = law._min_delay, law._max_delay
+    if lam == 0:
+        return hi, hi**2
+    e_lo, e_hi = m.exp(-lam*lo), m.exp(-lam*hi)
+    mean = lo + (e_lo - e_hi)/lam
+    sq = lo**2 + 2*((lo/lam + 1/lam**2)*e_lo - (hi/lam + 1/lam**2)*e_hi)
+    return mean, sq
+
+
+def _arrival_rate(law: TrafficFlowLaw, lam: float,
+                  p: float) -> tuple[float, float]:
+    delay, delay_sq = wave_delay_moments(law, lam)
+    n = law._max_cars
+    batch, batch_var = n*p, n*p*(1 - p)
+    if batch == 0 or lam == 0:
+        return 0.0, 1.0
+    cv2 = (delay_sq - delay**2)/delay**2
+    return batch/delay, batch_var/batch + batch*cv2
+
+
+def arrival_rate(law: TrafficFlowLaw) -> tuple[float, float]:
+    # mean rate of cars and the index of dispersion of their counts
+    return _arrival_rate(law, *law_rates(law))
+
+
+def pass_time_moments(law: TrafficFlowLaw) -> tuple[float, float]:
+    # mean time a car holds its movement and the mean gap until the next
+    # car of the same lane can take the same exit: max(pass time, timeout)
+    a = law._min_time_on_intersec
+    b = a + law._intersec_span
+    tau = PRODUCER_ROAD_PASS_TIMEOUT
+    mean = (a + b)/2
+    if b <= tau:
+        gap = tau
+    elif a >= tau:
+        gap = mean
+    else:
+        gap = ((tau - a)*tau + (b*b - tau*tau)/2)/(b - a)
+    return mean, gap
+
+
+def _layout(width: int, height: int,
+            turn_probabilities: dict[str, ApproachTurnProbabilities]
+            ) -> Intersection:
+    # seeded with default laws, so that building it draws nothing from the
+    # shared generator and leaves the laws being estimated untouched
+    return Intersection(width, height, TrafficLight,
+                        turn_probabilities=turn_probabilities, seed=0)
+
+
+def estimate_timing(laws: dict[str, list[TrafficFlowLaw]],
+                    h_time: float, v_time: float,
+                    turn_probabilities: dict[str, ApproachTurnProbabilities]
+                    = None) -> TimingEstimate:
+    model = _layout(len(laws['T']), len(laws['L']), turn_probabilities)
+    cycle = h_time + v_time
+    green = {side: (h_time if side in 'LR' else v_time)/cycle
+             for side in laws}
+    tau = PRODUCER_ROAD_PASS_TIMEOUT
+
+    rates, times = {}, {}
+    for side, (prods, _) in model.roads.items():
+        for prod in prods:
+            law = laws[side][prod.pos]
+            rates[prod] = arrival_rate(law)
+            times[prod] = pass_time_moments(law)
+
+    # movements and the bits that keep each of them out
+    pairs = model.movements.movements
+    probability = {
+        (prod, cons): p
+        for prod in rates
+        for cons, p in model.movements.probabilities(prod)
+    }
+    blocked_by: list[list[int]] = [[] for _ in pairs]
+    for bit, entries in enumerate(model.occupancy._blocks[:len(pairs)]):
+        for entry in entries:
+            blocked_by[entry[0]].append(bit)
+
+    # the first lane to look at a freed bit takes it: lanes tick in road
+    # order, side by side, producers before the exits that free the bits
+    def turn(prod: ProducerRoad, freed_by: str) -> tuple[int, int]:
+        order = 2*SIDES.index(prod.side) - 2*SIDES.index(freed_by) - 1
+        return order % (2*len(SIDES)), prod.pos
+
+    # per lane, its movements as (probability, {other lane in the same
+    # phase: [share of its cars that keep the movement out, share of them
+    # that take the bits before it]})
+    lanes: dict[ProducerRoad, list[tuple[float, dict]]] = {}
+    for k, (prod, cons) in enumerate(pairs):
+        shares = {}
+        for j in blocked_by[k]:
+            other, exit_ = pairs[j]
+            if other is prod \
+                    or (other.side in 'LR') != (prod.side in 'LR'):
+                continue
+            share = shares.setdefault(other, [0.0, 0.0])
+            share[0] += probability[pairs[j]]
+            if turn(other, exit_.side) < turn(prod, exit_.side):
+                share[1] += probability[pairs[j]]
+        lanes.setdefault(prod, []).append((probability[prod, cons], shares))
+
+    def busy_together(prod: ProducerRoad, other: ProducerRoad,
+                      clearing: dict) -> float:
+        # chance that other has a queue while prod has one. Both clear the
+        # queue left by the red from the start of the green, then have one
+        # a share `rate/service` of the time, independently
+        g = green[prod.side]*cycle
+        a, b = clearing[prod], clearing[other]
+        x_a = min(1.0, rates[prod][0]/service[prod])
+        x_b = min(1.0, rates[other][0]/service[other])
+        both = min(a, b) + (x_b*(a - b) if a > b else x_a*(b - a)) \
+            + x_a*x_b*(g - max(a, b))
+        busy = a + x_a*(g - a)
+        return min(1.0, both/busy) if busy else 0.0
+
+    def headway(prod: ProducerRoad, clearing: dict) -> float:
+        # mean time the lane needs per car in its green: the gap behind the
+        # previous car of the lane, then the wait for the conflicting
+        # movements. A lane that takes the bits first keeps them, car after
+        # car, as long as it has a queue; the cars of the other lanes only
+        # for their own pass time, those enter as Poisson streams (M/G/inf
+        # busy periods)
+        _, gap = times[prod]
+        res = 0.0
+        for p, shares in lanes[prod]:
+            free, held, weight = 1.0, 0.0, 0.0
+            entering = load = 0.0
+            for other, (q, q_first) in shares.items():
+                pass_time = times[other][0]
+                if q_first and clearing and service[other]:
+                    # share of its queue time other holds one of the bits
+                    holding = min(1.0, service[other]*q_first*pass_time)
+                    blocked = holding*busy_together(prod, other, clearing)
+                    free *= 1 - blocked
+                    weight += blocked
+                    held += blocked/service[other]
+                flow = rates[other][0]*(q - q_first)
+                entering += flow
+                load += flow*pass_time
+            if free <= 0:
+                return m.inf
+            wait = 0.0
+            if weight:
+                # a car of the queue ahead of it per headway of that lane
+                wait += (1 - free)/free*held/weight
+            if entering:
+                # residual of a busy period, taken as half of it
+                wait += -m.expm1(-load)*m.expm1(load)/entering/2
+            res += p*(p*gap + (1 - p)*tau + wait)
+        return res
+
+    # service rates and queue clearing times depend on each other, they
+    # are settled by damped rounds from the lanes running alone
+    service = {prod: 1/headway(prod, {}) for prod in lanes}
+    for _ in range(50):
+        clearing = {}
+        for prod, rate in service.items():
+            g = green[prod.side]*cycle
+            arriving = rates[prod][0]
+            clearing[prod] = g if rate <= arriving \
+                else min(g, arriving*(cycle - g)/(rate - arriving))
+        service = {prod: (service[prod] + 1/headway(prod, clearing))/2
+                   for prod in lanes}
+
+    def stopped(prod: ProducerRoad) -> float:
+        # time from the start of the green the lane stands still: its head
+        # stops at the first car that a lane clearing its queue first
+        # keeps out, holding up the cars behind it
+        held = []
+        for p, shares in lanes[prod]:
+            until = max((min(1.0, service[o]*q_first*times[o][0])
+                         * clearing[o]
+                         for o, (_, q_first) in shares.items() if q_first),
+                        default=0.0)
+            if until:
+                held.append((p, until))
+        share = sum(p for p, _ in held)
+        if not share:
+            return 0.0
+        reached = (1 - share)/share/service[prod]
+        return sum(p/share*max(0.0, until - reached) for p, until in held)
+
+    res = {side: [None]*len(side_laws) for side, side_laws in laws.items()}
+    for prod in lanes:
+        rate, dispersion = rates[prod]
+        g = green[prod.side]
+        capacity = g*service[prod]
+        x = rate/capacity if capacity else m.inf if rate else 0.0
+        if x >= 1:
+            estimate = LaneEstimate(rate, capacity, x, m.inf, m.inf)
+        else:
+            # Webster, the red lasting until the lane starts to move
+            g = max(0.0, g - stopped(prod)/cycle)
+            uniform = cycle*(1 - g)**2/(2*(1 - rate/service[prod]))
+            overflow = dispersion*x**2/(2*rate*(1 - x)) if rate else 0.0
+            wait = uniform + overflow
+            estimate = LaneEstimate(rate, capacity, x, wait, rate*wait)
+        res[prod.side][prod.pos] = estimate
+    return res
+
+
+def is_stable(estimate: TimingEstimate) -> bool:
+    return all(lane.stable for lanes in estimate.values() for lane in lanes)
+
+
+def mean_wait(estimate: TimingEstimate) -> float:
+    # mean wait of a car, averaged over all the lanes by their arrival rates
+    lanes = [lane for lanes in estimate.values() for lane in lanes]
+    total = sum(lane.arrival_rate for lane in lanes)
+    if not total:
+        return 0.0
+    return sum(lane.arrival_rate*lane.mean_wait for lane in lanes)/total
+
+
+def prescreen(laws: dict[str, list[TrafficFlowLaw]],
+              timings: Iterable[tuple[float, float]],
+              turn_probabilities: dict[str, ApproachTurnProbabilities]
+              = None) -> list[tuple[tuple[float, float], float]]:
+    # (h_time, v_time) candidates that are not oversaturated, best first
+    res = []
+    for h_time, v_time in timings:
+        estimate = estimate_timing(laws, h_time, v_time, turn_probabilities)
+        if is_stable(estimate):
+            res.append(((h_time, v_time), mean_wait(estimate)))
+    return sorted(res, key=lambda x: x[1])
+
+
+if __name__ == '__main__':
+    from lib import LIGHT_CYCLE_DUR
+
+    law = TrafficFlowLaw(max_cars=3, avg_car_count=2, lambda_=1/40,
+                         min_delay=4, max_delay=200, min_time_on_intersec=0.3,
+                         max_time_on_intersec=6)
+    laws = {side: [law for _ in range(3)] for side in 'TRBL'}
+    candidates = [(h, LIGHT_CYCLE_DUR - h)
+                  for h in range(10, LIGHT_CYCLE_DUR, 10)]
+    for (h, v), wait in prescreen(laws, candidates):
+        print(f"h={h:>3} v={v:>3}: mean wait {wait:.1f} s")
@@ -0,0 +1,149 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from geometry import *
+from lib import ModelState, SIDES
+from replay import ReplayLog
+
+
+BACKGROUND_COLOR = '#d9d9d9'
+TEXT_COLOR = 'black'
+COUNT_LABEL_OFFSET = 14
+ARROW_HEAD = (10, 4)    # length, half width
+
+FRAMES_PER_TASK = 64
+
+
+def static_layer(width: int, height: int) -> Image.Image:
+    # everything that does not change from frame to frame
+    X_MID, Y_MID = mids(width, height)
+    img = Image.new('RGB', (2*X_MID + 2, 2*Y_MID + 2), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(img)
+    for kind, coords, cfg in decorations(width, height):
+        if kind == 'line':
+            draw.line(coords, fill=cfg['fill'], width=max(1, cfg['width']))
+        else:
+            draw.rectangle(coords, fill=cfg['fill'])
+    for rects in crosswalks(width, height).values():
+        for rect in rects:
+            draw.rectangle(rect, fill=CROSSWALK_COLOR)
+    return img
+
+
+def _draw_arrow(draw: ImageDraw.ImageDraw, coords: tuple[float, ...]):
+    x, y, x1, y1 = coords
+    draw.line(coords, fill=ARROW_COLOR, width=ARROW_WIDTH)
+    dx, dy = x1 - x, y1 - y
+    length = (dx*dx + dy*dy)**0.5
+    if not length:
+        return
+    ux, uy = dx/length, dy/length
+    back, half = ARROW_HEAD
+    bx, by = x1 - ux*back, y1 - uy*back
+    draw.polygon([(x1, y1), (bx - uy*half, by + ux*half),
+                  (bx + uy*half, by - ux*half)], fill=ARROW_COLOR)
+
+
+def render_frame(state: ModelState, static: Image.Image) -> Image.Image:
+    width, height = state.width, state.height
+    img = static.copy()
+    draw = ImageDraw.Draw(img)
+
+    for i, side in enumerate(SIDES):
+        for pos in range(width if side in 'TB' else height):
+            src, src_pos, left, dur, _ = state.exits[i, pos]
+            if src < 0:
+                continue
+            coords = arrow(width, height, SIDES[int(src)], int(src_pos),
+                           side, pos)
+            _draw_arrow(draw, moving_arrow(coords, left/dur if dur else 0))
+
+        for pos in range(width if side in 'TB' else height):
+            x, y, *_ = arrow(width, height, side, pos, side, 0)
+            dx, dy = {'T': (0, 1), 'R': (-1, 0),
+                      'B': (0, -1), 'L': (1, 0)}[side]
+            draw.text((x + dx*COUNT_LABEL_OFFSET, y + dy*COUNT_LABEL_OFFSET),
+                      str(state.queues[i, pos]), fill='white', anchor='mm')
+
+    lenses, box = traffic_light(width, height)
+    for side, coords in lenses.items():
+        draw.ellipse(coords, fill=LIGHT_LENS_COLORS[state.light(side)])
+    draw.rectangle(box, fill=LIGHT_BOX_COLOR)
+
+    draw.text((4, 4), f"{state.time:.1f} s", fill=TEXT_COLOR)
+    return img
+
+
+def _render_range(path: str, times: list[float], out_dir: str = None,
+                  first_index: int = 0) -> list[bytes]:
+    # frames are saved as files when `out_dir` is given, returned raw
+    # otherwise
+    log = ReplayLog(path)
+    static = static_layer(log.width, log.height)
+    res = []
+    log.seek(times[0])
+    for i, t in enumerate(times):
+        log.tick(t - log.time)
+        img = render_frame(log.state, static)
+        if out_dir is None:
+            res.append(img.tobytes())
+        else:
+            img.save(os.path.join(out_dir, f"frame_{first_index + i:06d}.png"))
+    log.close()
+    return res
+
+
+def render(path: str, out: str, fps: int = 30, speed: float = 60,
+           start: float = 0, end: float = None, processes: int = None):
+    # `out` is either a directory for a png sequence or a video file encoded
+    # by ffmpeg; `speed` sim seconds pass per second of video
+    log = ReplayLog(path)
+    end = log.duration if end is None else min(end, log.duration)
+    size = static_layer(log.width, log.height).size
+    log.close()
+
+    count = int((end - start)*fps/speed) + 1
+    times = [start + i*speed/fps for i in range(count)]
+    chunks = [times[i:i + FRAMES_PER_TASK]
+              for i in range(0, count, FRAMES_PER_TASK)]
+    to_video = os.path.splitext(out)[1] != ''
+
+    if not to_video:
+        os.makedirs(out, exist_ok=True)
+    encoder = subprocess.Popen([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{size[0]}x{size[1]}",
+        '-r', str(fps), '-i', '-', '-pix_fmt', 'yuv420p', out
+    ], stdin=subprocess.PIPE) if to_video else None
+
+    with ProcessPoolExecutor(processes) as pool:
+        results = pool.map(
+            _render_range,
+            [path]*len(chunks),
+            chunks,
+            [None if to_video else out]*len(chunks),
+            range(0, count, FRAMES_PER_TASK)
+        )
+        # map keeps the order of the chunks, frames reach the encoder in order
+        for frames in results:
+            for frame in frames:
+                encoder.stdin.write(frame)
+
+    if encoder:
+        encoder.stdin.close()
+        encoder.wait()
+
+
+if __name__ == '__main__':
+    match sys.argv[1:]:
+        case [path, out]:
+            render(path, out)
+        case [path, out, speed]:
+            render(path, out, speed=float(speed))
+        case _:
+            print("usage: render.py <log> <frames dir | video file> "
+                  "[sim seconds per video second]")
@@ -0,0 +1,247 @@
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from intersection import Intersection
+from lib import (ModelState, ProducerRoad, ConsumerRoad, SIDES,
+                 OPT_LIGHT_HISTORY_SIZE)
+
+
+# Log file layout: FILE_HEADER, then records of RECORD_HEADER (sim time,
+# kind) followed by the payload of that kind. KEYFRAME records hold every
+# array of a `ModelState`; `<log>.idx` lists (sim time, offset) of each one
+
+MAGIC = b'TLSR'
+FILE_HEADER = struct.Struct('<4sHHI')   # magic, width, height, history size
+RECORD_HEADER = struct.Struct('<dB')
+
+LIGHT, WAVE, ENTER, CLEAR, SAMPLE, KEYFRAME = range(6)
+PAYLOADS = {
+    LIGHT: struct.Struct('<4B'),        # color of every side
+    WAVE: struct.Struct('<BHI'),        # side, pos, cars in queue
+    ENTER: struct.Struct('<BHBHdI'),    # producer side, pos, consumer side,
+                                        # pos, pass duration, cars in queue
+    CLEAR: struct.Struct('<BH'),        # consumer side, pos
+    SAMPLE: struct.Struct('<4d'),       # X, H, V, A
+}
+INDEX_DTYPE = np.dtype([('time', '<f8'), ('offset', '<u8')])
+
+STATE_ARRAYS = ('header', 'lights', 'queues', 'exits', 'samples')
+
+
+class Recorder:
+    def __init__(self, model: Intersection, path: str,
+                 keyframe_interval: float = 60.0):
+        self.model = model
+        self.time = 0.0
+        self._now = 0.0
+        self._keyframe_interval = keyframe_interval
+        self._next_keyframe = keyframe_interval
+
+        self.state = ModelState(model.width, model.height,
+                                OPT_LIGHT_HISTORY_SIZE)
+        self.state.reset()
+        self._log = open(path, 'wb')
+        self._index = open(path + '.idx', 'wb')
+        self._log.write(FILE_HEADER.pack(MAGIC, model.width, model.height,
+                                         OPT_LIGHT_HISTORY_SIZE))
+
+        model.light_changed += self._on_light_changed
+        model.wave_arrived += self._on_wave_arrived
+        model.car_entered_intersection += self._on_car_entered
+        model.exit_road_cleared += self._on_exit_cleared
+        self._write_keyframe()
+
+    def _write(self, kind: int, *args):
+        self._log.write(RECORD_HEADER.pack(self._now, kind))
+        self._log.write(PAYLOADS[kind].pack(*args))
+
+    def _on_light_changed(self, args: dict[str, str]):
+        self.state.on_light_changed(args)
+        self._write(LIGHT, *self.state.lights)
+
+    def _on_wave_arrived(self, road: ProducerRoad):
+        self._write(WAVE, SIDES.index(road.side), road.pos, road.car_count)
+
+    def _on_car_entered(self, args: tuple[ProducerRoad, ConsumerRoad]):
+        prod, cons = args
+        self.state.on_car_entered(args)
+        self._write(ENTER, SIDES.index(prod.side), prod.pos,
+                    SIDES.index(cons.side), cons.pos, cons.consumption_time,
+                    prod.car_count)
+
+    def _on_exit_cleared(self, cons: ConsumerRoad):
+        self.state.on_exit_cleared(cons)
+        self._write(CLEAR, SIDES.index(cons.side), cons.pos)
+
+    def _write_keyframe(self):
+        self._index.write(struct.pack('<dQ', self.time, self._log.tell()))
+        self._log.write(RECORD_HEADER.pack(self.time, KEYFRAME))
+        for name in STATE_ARRAYS:
+            self._log.write(getattr(self.state, name).tobytes())
+
+    def tick(self, dt: float):
+        self._now = self.time + dt
+        self.model.tick(dt)
+        self.time = self._now
+
+        samples_count = self.state.header[1]
+        last_x = self.state.samples[0, int(samples_count) - 1]
+        self.state.update(self.time, self.model.roads,
+                          self.model.get_samples())
+        if self.state.header[1] != samples_count \
+                or self.state.samples[0, int(samples_count) - 1] != last_x:
+            self._write(SAMPLE, *self.model.get_samples()[:, -1])
+
+        if self.time >= self._next_keyframe:
+            self._write_keyframe()
+            self._next_keyframe += self._keyframe_interval
+
+    def close(self):
+        self._write_keyframe()
+        self._log.close()
+        self._index.close()
+
+
+# Memory-mapped recorded run; `seek` restores the closest keyframe before
+# the requested time and applies only the records after it
+class ReplayLog:
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.width, self.height, history_size = \
+            FILE_HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise Exception(f"'{path}' is not a recorded run")
+
+        self._index_file = open(path + '.idx', 'rb')
+        self._index_mm = mmap.mmap(self._index_file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        self._index = np.frombuffer(self._index_mm, INDEX_DTYPE)
+        if not len(self._index):
+            raise Exception(f"'{path}' has no keyframes")
+
+        self.state = ModelState(self.width, self.height, history_size)
+        size = max(self.width, self.height)
+        self._entered = np.zeros((4, size))
+        self._keyframe_size = sum(
+            int(np.prod(shape))*np.dtype(dtype).itemsize
+            for shape, dtype in ModelState.layout(self.width, self.height,
+                                                  history_size).values()
+        )
+        self.time = 0.0
+        self.seek(0.0)
+
+    @property
+    def duration(self) -> float:
+        return float(self._index['time'][-1])
+
+    def seek(self, t: float):
+        t = min(max(t, 0.0), self.duration)
+        i = max(0, int(np.searchsorted(self._index['time'], t, 'right')) - 1)
+        pos = int(self._index['offset'][i]) + RECORD_HEADER.size
+        for name in STATE_ARRAYS:
+            arr = getattr(self.state, name)
+            arr[...] = np.frombuffer(self._mm, arr.dtype, arr.size, pos)\
+                .reshape(arr.shape)
+            pos += arr.nbytes
+        self._pos = pos
+
+        time = float(self._index['time'][i])
+        exits = self.state.exits
+        self._entered[:] = time - (exits[..., 3] - exits[..., 2])
+        self.time = time
+        self._advance(t)
+
+    def tick(self, dt: float):
+        self._advance(self.time + dt)
+
+    def _advance(self, t: float):
+        if t < self.time:
+            return self.seek(t)
+
+        t = min(t, self.duration)
+        mm, state = self._mm, self.state
+        while self._pos < len(mm):
+            time, kind = RECORD_HEADER.unpack_from(mm, self._pos)
+            if time > t:
+                break
+            pos = self._pos + RECORD_HEADER.size
+            if kind == KEYFRAME:
+                self._pos = pos + self._keyframe_size
+                continue
+            payload = PAYLOADS[kind]
+            self._apply(time, kind, payload.unpack_from(mm, pos))
+            self._pos = pos + payload.size
+
+        self.time = t
+        exits = state.exits
+        np.maximum(exits[..., 3] - (t - self._entered), 0, out=exits[..., 2])
+        state.header[0] = t
+
+    def _apply(self, time: float, kind: int, args: tuple):
+        state = self.state
+        if kind == LIGHT:
+            state.lights[:] = args
+        elif kind == WAVE:
+            side, pos, count = args
+            state.queues[side, pos] = count
+        elif kind == ENTER:
+            pside, ppos, cside, cpos, dur, count = args
+            state.queues[pside, ppos] = count
+            state.header[2] += 1
+            state.exits[cside, cpos] = (pside, ppos, dur, dur,
+                                        state.header[2])
+            self._entered[cside, cpos] = time
+        elif kind == CLEAR:
+            side, pos = args
+            state.exits[side, pos, 0] = -1
+        elif kind == SAMPLE:
+            n = int(state.header[1])
+            if n == 1 and state.samples[0, 0] == -1:
+                state.samples[:, 0] = args
+            elif n == state.samples.shape[1]:
+                state.samples[:, :-1] = state.samples[:, 1:].copy()
+                state.samples[:, -1] = args
+            else:
+                state.samples[:, n] = args
+                state.header[1] = n + 1
+
+    def get_samples(self) -> np.ndarray:
+        return self.state.get_samples()
+
+    def close(self):
+        del self._index
+        self._index_mm.close()
+        self._index_file.close()
+        self._mm.close()
+        self._file.close()
+
+
+def record(path: str, duration: float, light_type=None, dt: float = 0.1,
+           keyframe_interval: float = 60.0):
+    from lib import TrafficLight
+
+    model = Intersection(3, 3, light_type or TrafficLight)
+    recorder = Recorder(model, path, keyframe_interval)
+    for _ in range(int(duration/dt)):
+        recorder.tick(dt)
+    recorder.close()
+
+
+if __name__ == '__main__':
+    match sys.argv[1:]:
+        case ['record', path, duration]:
+            from optimized import OptimizingTrafficLight
+            record(path, float(duration), OptimizingTrafficLight)
+        case ['view', path]:
+            from ui import App
+            root = App([ReplayLog(path)], labels=[path])
+            root.title("Traffic Light Sim v0.1 - replay")
+            root.geometry('1200x700+300+200')
+            root.loop()
+        case _:
+            print("usage: replay.py record <log> <duration, s> | "
+                  "view <log>")
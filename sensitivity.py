@@ -0,0 +1,341 @@
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, NamedTuple
+
+import numpy as np
+
+from intersection import Intersection
+from lib import TrafficFlowLaw, TrafficLight, SIDES
+
+
+# law of `Intersection` when none is given, studied parameters vary around it
+BASE_LAW = dict(max_cars=12, avg_car_count=3, lambda_=1/120, min_delay=20,
+                max_delay=240, min_time_on_intersec=1,
+                max_time_on_intersec=5)
+DEFAULT_RANGES = dict(lambda_=(1/240, 1/40), avg_car_count=(1, 6),
+                      max_cars=(6, 18), min_time_on_intersec=(0.5, 2),
+                      max_time_on_intersec=(3, 8))
+
+
+class Parameter(NamedTuple):
+    name: str       # keyword of `TrafficFlowLaw`
+    sides: str      # approaches it is varied on together, e.g. 'LR'
+    low: float
+    high: float
+
+    @property
+    def label(self):
+        return f"{self.name}[{self.sides}]"
+
+
+def default_parameters() -> list[Parameter]:
+    # 10 parameters: each studied one, horizontal and vertical approaches
+    # apart
+    return [Parameter(name, sides, *bounds)
+            for sides in ('LR', 'TB')
+            for name, bounds in DEFAULT_RANGES.items()]
+
+
+def make_laws(params: list[Parameter], point: tuple[float, ...],
+              width: int, height: int) -> dict[str, list[TrafficFlowLaw]]:
+    values = {side: dict(BASE_LAW) for side in SIDES}
+    for param, x in zip(params, point):
+        for side in param.sides:
+            values[side][param.name] = x
+
+    laws = {}
+    for side, kwargs in values.items():
+        # keep every point a valid law
+        kwargs['max_cars'] = max(1, round(kwargs['max_cars']))
+        kwargs['avg_car_count'] = min(kwargs['avg_car_count'],
+                                      kwargs['max_cars'])
+        kwargs['max_time_on_intersec'] = max(kwargs['max_time_on_intersec'],
+                                             kwargs['min_time_on_intersec'])
+        laws[side] = [TrafficFlowLaw(**kwargs)
+                      for _ in range(width if side in 'TB' else height)]
+    return laws
+
+
+class RunSettings(NamedTuple):
+    width: int = 3
+    height: int = 3
+    duration: float = 2*3600
+    warmup: float = 1800
+    dt: float = 0.1
+
+
+# (light type, parameters, point, seed, settings)
+Job = tuple[type[TrafficLight], tuple[Parameter, ...], tuple[float, ...],
+            int, RunSettings]
+
+
+def run_point(light_type: type[TrafficLight], params: list[Parameter],
+              point: tuple[float, ...], seed: int,
+              settings: RunSettings) -> float:
+    # mean wait of a car after the warm-up, by Little's law from the
+    # car-seconds spent in queues, so that cars still queued at the end of
+    # an oversaturated run are not left out
+    width, height, duration, warmup, dt = settings
+    model = Intersection(width, height, light_type,
+                         make_laws(params, point, width, height), seed=seed)
+    tick = model.tick
+    for _ in range(int(warmup/dt)):
+        tick(dt)
+
+    prods = [p for prods, _ in model.roads.values() for p in prods]
+    light = model.traffic_light
+    queued, waited = sum(p.car_count for p in prods), light.total_waiting
+    entered = [0]
+
+    def on_car_entered(_): entered[0] += 1
+    model.car_entered_intersection += on_car_entered
+    for _ in range(int((duration - warmup)/dt)):
+        tick(dt)
+
+    arrived = entered[0] + sum(p.car_count for p in prods) - queued
+    return (light.total_waiting - waited)/arrived if arrived > 0 else 0.0
+
+
+def _run_batch(jobs: list[Job]) -> list[float]:
+    return [run_point(*job) for job in jobs]
+
+
+def _job_key(job: Job) -> str:
+    light_type, params, point, seed, settings = job
+    return json.dumps([
+        f"{light_type.__module__}.{light_type.__qualname__}",
+        [[p.name, p.sides, x] for p, x in zip(params, point)],
+        seed, list(settings)
+    ])
+
+
+# Results of finished runs, appended to a json lines file as they come in:
+# an interrupted study resumes where it stopped, a larger one reuses the
+# runs of the smaller ones (designs are drawn so that they extend)
+class RunCache:
+    def __init__(self, path: str = None):
+        self.path = path
+        self._runs: dict[str, float] = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    key, value = json.loads(line)
+                    self._runs[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._runs
+
+    def __getitem__(self, key: str) -> float:
+        return self._runs[key]
+
+    def __len__(self):
+        return len(self._runs)
+
+    def add(self, items: list[tuple[str, float]]):
+        self._runs.update(items)
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.writelines(json.dumps(item) + '\n' for item in items)
+
+
+def evaluate(light_types: list[type[TrafficLight]],
+             params: list[Parameter],
+             units: np.ndarray,
+             replications: int = 1,
+             settings: RunSettings = RunSettings(),
+             cache: RunCache = None,
+             processes: int = None,
+             batch_size: int = 16,
+             progress: Callable[[int, int, int], Any] = None
+             ) -> dict[str, np.ndarray]:
+    # output of every row of a unit cube design, per controller. Every row
+    # is run with the same seeds (common random numbers); duplicate and
+    # cached runs are not repeated. `progress(done, total, cached)` is
+    # called with the run counts before the first batch and after each one
+    cache = cache if cache is not None else RunCache()
+    params = tuple(params)
+    lows = np.array([p.low for p in params])
+    spans = np.array([p.high for p in params]) - lows
+    points = [tuple(map(float, row)) for row in lows + units*spans]
+
+    jobs = {}
+    for light_type in light_types:
+        for point in points:
+            for seed in range(replications):
+                job = (light_type, params, point, seed, settings)
+                key = _job_key(job)
+                if key not in cache:
+                    jobs[key] = job
+
+    keys = list(jobs)
+    if keys:
+        cached = len(cache)
+        if progress:
+            progress(0, len(keys), cached)
+        with ProcessPoolExecutor(processes) as pool:
+            batches = {
+                pool.submit(_run_batch,
+                            [jobs[key] for key in keys[i:i + batch_size]]):
+                keys[i:i + batch_size]
+                for i in range(0, len(keys), batch_size)
+            }
+            done = 0
+            for future in as_completed(batches):
+                cache.add(list(zip(batches[future], future.result())))
+                done += len(batches[future])
+                if progress:
+                    progress(done, len(keys), cached)
+
+    return {
+        light_type.__name__: np.array([
+            np.mean([cache[_job_key((light_type, params, point, seed,
+                                     settings))]
+                     for seed in range(replications)])
+            for point in points
+        ])
+        for light_type in light_types
+    }
+
+
+def saltelli_design(dims: int, samples: int, seed: int = 0) -> np.ndarray:
+    # rows A, B, then A with column i taken from B for every i. Rows of A
+    # and B are drawn in pairs, a larger `samples` extends a smaller design
+    base = np.random.default_rng(seed).random((samples, 2*dims))
+    a, b = base[:, :dims], base[:, dims:]
+    ab = np.tile(a, (dims, 1, 1))
+    for i in range(dims):
+        ab[i, :, i] = b[:, i]
+    return np.concatenate([a, b, *ab])
+
+
+def sobol_indices(y: np.ndarray, dims: int, resamples: int = 200,
+                  seed: int = 0) -> dict[str, np.ndarray]:
+    # first order (Saltelli 2010) and total (Jansen) indices of a
+    # `saltelli_design` output, with bootstrap 95% half-widths
+    n = len(y)//(dims + 2)
+    y_a, y_b = y[:n], y[n:2*n]
+    y_ab = y[2*n:].reshape(dims, n)
+
+    def indices(rows):
+        a, b, ab = y_a[rows], y_b[rows], y_ab[:, rows]
+        var = np.var(np.concatenate([a, b]))
+        if not var:
+            return np.zeros(dims), np.zeros(dims)
+        return (np.mean(b*(ab - a), axis=1)/var,
+                np.mean((a - ab)**2, axis=1)/(2*var))
+
+    first, total = indices(np.arange(n))
+    rng = np.random.default_rng(seed)
+    boot = [indices(rng.integers(0, n, n)) for _ in range(resamples)]
+    first_conf, total_conf = (1.96*np.std([b[i] for b in boot], axis=0)
+                              for i in range(2))
+    return dict(S1=first, S1_conf=first_conf, ST=total, ST_conf=total_conf)
+
+
+def morris_design(dims: int, trajectories: int, levels: int = 4,
+                  seed: int = 0) -> np.ndarray:
+    # `trajectories` one-at-a-time paths of dims + 1 points on a grid of
+    # `levels` levels, each step moving one factor by delta. Trajectories
+    # are drawn one after another, more of them extend a smaller design
+    delta = levels/(2*(levels - 1))
+    rng = np.random.default_rng(seed)
+    res = []
+    for _ in range(trajectories):
+        up = rng.random(dims) < 0.5
+        start = rng.integers(0, levels//2, dims)/(levels - 1)
+        x = np.where(up, start, start + delta)
+        path = [x.copy()]
+        for i in rng.permutation(dims):
+            x[i] += delta if up[i] else -delta
+            path.append(x.copy())
+        res += path
+    return np.array(res)
+
+
+def morris_indices(units: np.ndarray, y: np.ndarray
+                   ) -> dict[str, np.ndarray]:
+    # elementary effects, in output units per whole parameter range
+    dims = units.shape[1]
+    effects = [[] for _ in range(dims)]
+    for start in range(0, len(y), dims + 1):
+        x, fx = units[start:start + dims + 1], y[start:start + dims + 1]
+        for k in range(dims):
+            i = int(np.argmax(x[k + 1] != x[k]))
+            effects[i].append((fx[k + 1] - fx[k])/(x[k + 1, i] - x[k, i]))
+    effects = np.array(effects)
+    return dict(mu=effects.mean(axis=1),
+                mu_star=np.abs(effects).mean(axis=1),
+                sigma=effects.std(axis=1, ddof=1) if effects.shape[1] > 1
+                else np.zeros(dims))
+
+
+def sensitivity(light_types: list[type[TrafficLight]],
+                params: list[Parameter] = None,
+                method: str = 'sobol',
+                samples: int = 128,
+                replications: int = 1,
+                settings: RunSettings = RunSettings(),
+                cache: RunCache = None,
+                seed: int = 0,
+                processes: int = None,
+                batch_size: int = 16,
+                progress: Callable[[int, int, int], Any] = None
+                ) -> dict[str, dict[str, dict[str, float]]]:
+    # indices of every parameter on the mean wait of a car, per controller.
+    # `samples` is the base sample count for sobol (samples*(d + 2) points)
+    # and the trajectory count for morris (samples*(d + 1) points)
+    params = params or default_parameters()
+    dims = len(params)
+    match method:
+        case 'sobol':
+            units = saltelli_design(dims, samples, seed)
+        case 'morris':
+            units = morris_design(dims, samples, seed=seed)
+        case _:
+            raise Exception(f"Unknown method '{method}'")
+
+    outputs = evaluate(light_types, params, units, replications, settings,
+                       cache, processes, batch_size, progress)
+    res = {}
+    for controller, y in outputs.items():
+        indices = sobol_indices(y, dims, seed=seed) if method == 'sobol' \
+            else morris_indices(units, y)
+        res[controller] = {
+            param.label: {name: float(values[i])
+                          for name, values in indices.items()}
+            for i, param in enumerate(params)
+        }
+    return res
+
+
+if __name__ == '__main__':
+    from optimized import OptimizingTrafficLight
+
+    match sys.argv[1:]:
+        case [method, samples, cache_path]:
+            pass
+        case [method, samples]:
+            cache_path = 'sensitivity_runs.jsonl'
+        case _:
+            print("usage: sensitivity.py sobol|morris <samples> "
+                  "[run cache, sensitivity_runs.jsonl]")
+            sys.exit(1)
+
+    def print_progress(done: int, total: int, cached: int):
+        if not done:
+            print(f"{total} runs to do, {cached} cached", file=sys.stderr)
+        else:
+            print(f"{done}/{total} runs done", file=sys.stderr)
+
+    report = sensitivity([TrafficLight, OptimizingTrafficLight],
+                         method=method, samples=int(samples),
+                         cache=RunCache(cache_path),
+                         progress=print_progress)
+    for controller, by_param in report.items():
+        print(controller)
+        for label, indices in by_param.items():
+            print(f"  {label:>28}: " + ", ".join(
+                f"{name}={value:.3f}" for name, value in indices.items()
+            ))
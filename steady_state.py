@@ -0,0 +1,71 @@
+from typing import NamedTuple
+
+import numpy as np
+
+from intersection import Intersection
+from lib import (TrafficLight, Interval, mser_truncation, batch_means,
+                 OPT_LIGHT_AVERAGING_DUR)
+
+
+SAMPLE_ROWS = dict(zip('XHVA', range(4)))
+
+
+class SteadyStateEstimate(NamedTuple):
+    interval: Interval
+    warmup_samples: int
+    samples: int
+    sim_time: float
+    converged: bool
+
+
+# Runs a single long simulation, collecting the averaging series of the
+# traffic light, until the batch-means confidence interval of its
+# steady-state mean (warm-up cut off by MSER) is narrow enough
+def estimate_steady_state(model: Intersection,
+                          row: str = 'A',
+                          rel_precision: float = 0.05,
+                          confidence: float = 0.95,
+                          batches: int = 20,
+                          min_batch_size: int = 5,
+                          dt: float = 0.1,
+                          max_time: float = 7*24*3600,
+                          check_every: int = 10) -> SteadyStateEstimate:
+    series = []
+    last_x = None
+    time = 0.0
+    interval, warmup = Interval(0.0, float('inf')), 0
+
+    while time < max_time:
+        model.tick(dt)
+        time += dt
+
+        samples = model.get_samples()
+        if samples[0, -1] == -1 or samples[0, -1] == last_x:
+            continue
+        last_x = samples[0, -1]
+        series.append(samples[SAMPLE_ROWS[row], -1])
+
+        if len(series) % check_every:
+            continue
+        data = np.array(series)
+        warmup = mser_truncation(data)
+        if len(data) - warmup < batches*min_batch_size:
+            continue
+        interval = batch_means(data[warmup:], batches, confidence)
+        if interval.relative_precision <= rel_precision:
+            return SteadyStateEstimate(interval, warmup, len(series), time,
+                                       True)
+
+    return SteadyStateEstimate(interval, warmup, len(series), time, False)
+
+
+if __name__ == '__main__':
+    from optimized import OptimizingTrafficLight
+
+    for light_type in (OptimizingTrafficLight, TrafficLight):
+        est = estimate_steady_state(Intersection(3, 3, light_type))
+        print(f"{light_type.__name__}: {est.interval.mean:.2f} "
+              f"± {est.interval.half_width:.2f}, "
+              f"warm-up {est.warmup_samples*OPT_LIGHT_AVERAGING_DUR} s, "
+              f"stopped at {est.sim_time:.0f} s "
+              f"({'converged' if est.converged else 'max time reached'})")
@@ -1,36 +1,32 @@
-from tkinter import Button, Tk, Label, Frame, Canvas
+from tkinter import Button, Tk, Label, Frame, Canvas, Scale
 
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.axes import Axes
 
+from geometry import *
 from intersection import Intersection
-from lib import Timer, ProducerRoad, ConsumerRoad
+from lib import Timer, ProducerRoad, ConsumerRoad, ModelState, SIDES
+from replay import ReplayLog
+from worker import ModelWorker
 
 
 FONT = "Helvetica 14"
 
-ROAD_WIDTH = 48
-ROAD_COLOR = '#203040'
-ROAD_MARK_YELLOW = '#dd4'
-ROAD_PAD_XY = 60
-
-ARROW_WIDTH = 3
-
-CROSSWALK_WIDTH = 26
-CROSSWALK_GAP = 6
-CROSSWALK_COLOR = '#ccc'
-
 GRAPH_UPDATE_INTERVAL = 3
 GRAPH_HISTORY_SIZE = 80
 
+REPLAY_MAX_SPEED_FACTOR = 1 << 16
+
 
 class App(Tk):
-    def __init__(self, models: list[Intersection], labels: list[str]):
+    def __init__(self, models: list[Intersection | ModelWorker | ReplayLog],
+                 labels: list[str]):
         super().__init__()
         self.model = models[0]
         self.models = models
         self.labels = labels
+        self._workers = [m for m in models if isinstance(m, ModelWorker)]
 
         self.protocol('WM_DELETE_WINDOW', self.close)
         self.resizable(False, False)
@@ -43,6 +39,24 @@ class App(Tk):
 
         self.timer = Timer(1/self._frame_rate)
         self._simulation_speed_factor = 1
+        self.arrows: dict[
+            ConsumerRoad, (ProducerRoad, int, tuple[int, ...], float)
+        ] = {}
+
+        # a model in a worker process or a replayed run is drawn from its
+        # state arrays
+        self._view: ModelState = None
+        self._replay = isinstance(self.model, ReplayLog)
+        self._max_speed_factor = REPLAY_MAX_SPEED_FACTOR if self._replay \
+            else 5*self._frame_rate
+        if isinstance(self.model, (ModelWorker, ReplayLog)):
+            self._view = self.model.state
+            self._shown_lights = {}
+            self._shown_counts = {}
+            if self._replay:
+                self._draw_seek_bar()
+            return
+
         for prods, _ in self.model.roads.values():
             for road in prods:
                 road.wave_arrived += self._on_wave_arrived
@@ -50,27 +64,15 @@ class App(Tk):
         self.model.light_changed += self._on_traffic_light_change
         self.model.car_entered_intersection += self._on_car_entered_inters
         self.model.exit_road_cleared += self._on_exit_cleared
-        self.arrows: dict[
-            ConsumerRoad, (ProducerRoad, int, tuple[int, ...], float)
-        ] = {}
 
     def _on_car_entered_inters(self, args: tuple[ProducerRoad, ConsumerRoad]):
         prod, cons = args
 
-        label = self.car_count_labels[prod.side][prod]
+        label = self.car_count_labels[prod.side][prod.pos]
         label.config(text=str(prod.car_count))
 
-        pside, p_ind = [
-            (side, prods.index(prod))
-            for side, (prods, _) in self.model.roads.items()
-            if prod in prods
-        ][0]
-        cside, c_ind = [
-            (side, conss.index(cons))
-            for side, (_, conss) in self.model.roads.items()
-            if cons in conss
-        ][0]
-        line_id, coords = self._add_arrow(pside, p_ind, cside, c_ind)
+        line_id, coords = self._add_arrow(prod.side, prod.pos,
+                                          cons.side, cons.pos)
         self.arrows[cons] = (prod, line_id, coords, cons.consumption_time)
 
     def _on_exit_cleared(self, end: ConsumerRoad):
@@ -79,16 +81,44 @@ class App(Tk):
     def _on_traffic_light_change(self, current_state: dict):
         for side, color in current_state.items():
             self.canvas.itemconfig(self.light_lens[side],
-                                   fill={'R': '#ff2222', 'G': '#22ff22'}[color])
+                                   fill=LIGHT_LENS_COLORS[color])
 
     def _on_wave_arrived(self, road: ProducerRoad):
-        label = self.car_count_labels[road.side][road]
+        label = self.car_count_labels[road.side][road.pos]
         label.config(text=str(road.car_count))
 
-    def _draw_ui(self):
-        def rectangle(x, y, w, h, **kwgs):
-            return canvas.create_rectangle(x, y, x + w, y + h, **kwgs)
+    def _sync_view(self, state: ModelState):
+        for i, side in enumerate(SIDES):
+            color = state.light(side)
+            if self._shown_lights.get(side) != color:
+                self._shown_lights[side] = color
+                self._on_traffic_light_change({side: color})
+
+            for pos, label in self.car_count_labels[side].items():
+                count = int(state.queues[i, pos])
+                if self._shown_counts.get((side, pos)) != count:
+                    self._shown_counts[(side, pos)] = count
+                    label.config(text=str(count))
+
+            for pos in range(len(self.car_count_labels[side])):
+                src, src_pos, left, dur, serial = state.exits[i, pos]
+                shown = self.arrows.get((side, pos))
+                if shown and (src < 0 or shown[0] != serial):
+                    self.canvas.delete(self.arrows.pop((side, pos))[1])
+                    shown = None
+                if src < 0:
+                    continue
+                if shown is None:
+                    line_id, coords = self._add_arrow(SIDES[int(src)],
+                                                      int(src_pos), side, pos)
+                    shown = self.arrows[(side, pos)] = (serial, line_id,
+                                                        coords, dur)
+                self._move_arrow(shown[1], shown[2], left/shown[3])
+
+    def _move_arrow(self, arrow_id: int, coords: tuple[int, ...], t: float):
+        self.canvas.coords(arrow_id, moving_arrow(coords, t))
 
+    def _draw_ui(self):
         def make_graph(parent, x, y, width, height):
             fig = Figure(figsize=(width/100 - 0.02, height / 100 - 0.02),
                          dpi=100,
@@ -103,57 +133,12 @@ class App(Tk):
             ax.set_ylabel('Час, с')
             return fig, ax
 
-        def make_decorations():
-            # Road plates: horizontal, vertical
-            canvas.create_rectangle(
-                0, ROAD_PAD_XY, 2*X_MID + 1, Y_MID*2 - ROAD_PAD_XY + 1,
-                fill=ROAD_COLOR, width=0
-            )
-            canvas.create_rectangle(
-                ROAD_PAD_XY, 0, 2*X_MID - ROAD_PAD_XY + 1, 2*Y_MID + 1,
-                fill=ROAD_COLOR, width=0
-            )
-
-            # Yellow lines: horizontal (left, right), vertical (top, bottom)
-            LINE_CFG = dict(fill=ROAD_MARK_YELLOW, width=2)
-            canvas.create_line(0, Y_MID, ROAD_PAD_XY, Y_MID,
-                               **LINE_CFG)
-            canvas.create_line(2*X_MID - ROAD_PAD_XY, Y_MID, 2*X_MID + 1, Y_MID,
-                               **LINE_CFG)
-            canvas.create_line(X_MID, 0, X_MID, ROAD_PAD_XY,
-                               **LINE_CFG)
-            canvas.create_line(X_MID, 2*Y_MID - ROAD_PAD_XY, X_MID, 2*Y_MID + 1,
-                               **LINE_CFG)
-
-            # horizontal lane delimiter lines
-            LANE_DELIM_LENGTH = ROAD_PAD_XY - CROSSWALK_WIDTH - 5
-            [
-                canvas.create_line(cur_x,
-                                   cur_y,
-                                   cur_x + LANE_DELIM_LENGTH,
-                                   cur_y,
-                                   fill='white', width=1)
-                for count in range(1, ROADS_H)
-                for cur_x in (0, 2*X_MID - LANE_DELIM_LENGTH)
-                for cur_y in (count*(ROAD_WIDTH + 1) - 1 + ROAD_PAD_XY,
-                              count*(ROAD_WIDTH + 1) - 1 + Y_MID)
-            ]
-            # vertical lane delimiter lines
-            [
-                canvas.create_line(cur_x,
-                                   cur_y,
-                                   cur_x,
-                                   cur_y + LANE_DELIM_LENGTH,
-                                   fill='white', width=0)
-                for count in range(1, ROADS_W)
-                for cur_y in (0, 2*Y_MID - LANE_DELIM_LENGTH)
-                for cur_x in (count*(ROAD_WIDTH + 1) - 1 + ROAD_PAD_XY,
-                              count*(ROAD_WIDTH + 1) - 1 + X_MID)
-            ]
+        def draw(shapes: list[Shape]):
+            for kind, coords, cfg in shapes:
+                getattr(canvas, 'create_' + kind)(*coords, **cfg)
 
         ROADS_W, ROADS_H = self.model.width, self.model.height
-        X_MID = ROAD_PAD_XY + ROADS_W*(ROAD_WIDTH + 1) - 1
-        Y_MID = ROAD_PAD_XY + ROADS_H*(ROAD_WIDTH + 1) - 1
+        X_MID, Y_MID = mids(ROADS_W, ROADS_H)
 
         CANVAS_PAD_Y = 80
         self.canvas_frame = Frame(self)
@@ -167,59 +152,23 @@ class App(Tk):
         self.graph_frame.place(x=550, y=50, width=600, height=500)
         self.figure, self.graph = make_graph(self.graph_frame, 0, 0, 600, 500)
 
-        make_decorations()
-
-        def make_crosswalks():
-            CROSSWALK_CFG = dict(fill=CROSSWALK_COLOR, width=0)
-
-            def p_left(i, line_num): return ROAD_PAD_XY + i*(ROAD_WIDTH + 1)\
-                + CROSSWALK_GAP//2 + 2*line_num*CROSSWALK_GAP
-            def p_top(i, line_num): return ROAD_PAD_XY + i*(ROAD_WIDTH + 1)\
-                + CROSSWALK_GAP//2 + 2*line_num*CROSSWALK_GAP
-
-            vertical = [
-                [
-                    rectangle(cur_left, cur_top,
-                              CROSSWALK_GAP, CROSSWALK_WIDTH,
-                              **CROSSWALK_CFG)
-                    for cur_top in (ROAD_PAD_XY - CROSSWALK_WIDTH,
-                                    2*Y_MID - ROAD_PAD_XY)
-                ]
-                for i in range(ROADS_W)
-                for line_n in range(ROAD_WIDTH // (2*CROSSWALK_GAP))
-                for cur_left in (p_left(i, line_n),
-                                 2*X_MID - p_left(i, line_n) - CROSSWALK_GAP)
-            ]
-            horizontal = [
-                [
-                    rectangle(cur_left, cur_top,
-                              CROSSWALK_WIDTH, CROSSWALK_GAP,
-                              **CROSSWALK_CFG)
-                    for cur_left in (ROAD_PAD_XY - CROSSWALK_WIDTH,
-                                     2*X_MID - ROAD_PAD_XY)
-                ]
-                for line_n in range(ROAD_WIDTH // (2*CROSSWALK_GAP))
-                for i in range(ROADS_H)
-                for cur_top in (p_top(i, line_n),
-                                2*Y_MID - p_top(i, line_n) - CROSSWALK_GAP)
-            ]
-            top, bottom = [*zip(*vertical)]
-            left, right = [*zip(*horizontal)]
-            return {
-                side: cw
-                for side, cw in zip('TRBL', (top, right, bottom, left))
-            }
+        draw(decorations(ROADS_W, ROADS_H))
 
         # Crosswalks
-        self.crosswalk_sprites = make_crosswalks()
+        CROSSWALK_CFG = dict(fill=CROSSWALK_COLOR, width=0)
+        self.crosswalk_sprites = {
+            side: [canvas.create_rectangle(*rect, **CROSSWALK_CFG)
+                   for rect in rects]
+            for side, rects in crosswalks(ROADS_W, ROADS_H).items()
+        }
 
         # Car count labels
         self.car_count_labels = {
             side: {
-                road: Label(self, text='0', justify='center', font=FONT)
-                for road in self.model.roads[side][0]
+                pos: Label(self, text='0', justify='center', font=FONT)
+                for pos in range(ROADS_W if side in 'TB' else ROADS_H)
             }
-            for side in self.model.roads
+            for side in SIDES
         }
         CAR_COUNT_LABEL_CFG = dict(width=ROAD_WIDTH, height=30)
         for i, lbl in enumerate(self.car_count_labels['T'].values()):
@@ -241,41 +190,13 @@ class App(Tk):
                       (ROAD_WIDTH + 1)*i + (ROAD_WIDTH - 30)//2,
                       **CAR_COUNT_LABEL_CFG)
 
-        def make_traffic_light():
-            HALF_TLB_SIZE = 10
-            LWIDTH = 6
-
-            top = canvas.create_oval(X_MID - HALF_TLB_SIZE + 1,
-                                     Y_MID - HALF_TLB_SIZE - LWIDTH,
-                                     X_MID + HALF_TLB_SIZE - 1,
-                                     Y_MID - HALF_TLB_SIZE + LWIDTH,
-                                     width=0)
-            right = canvas.create_oval(X_MID + HALF_TLB_SIZE - LWIDTH,
-                                       Y_MID - HALF_TLB_SIZE + 1,
-                                       X_MID + HALF_TLB_SIZE + LWIDTH,
-                                       Y_MID + HALF_TLB_SIZE - 1,
-                                       width=0)
-            bottom = canvas.create_oval(X_MID - HALF_TLB_SIZE + 1,
-                                        Y_MID + HALF_TLB_SIZE - LWIDTH,
-                                        X_MID + HALF_TLB_SIZE - 1,
-                                        Y_MID + HALF_TLB_SIZE + LWIDTH,
-                                        width=0)
-            left = canvas.create_oval(X_MID - HALF_TLB_SIZE - LWIDTH,
-                                      Y_MID - HALF_TLB_SIZE + 1,
-                                      X_MID - HALF_TLB_SIZE + LWIDTH,
-                                      Y_MID + HALF_TLB_SIZE - 1,
-                                      width=0)
-
-            X, Y, A = X_MID, Y_MID, HALF_TLB_SIZE
-            canvas.create_rectangle(X - A, Y - A, X + A + 1, Y + A + 1,
-                                    fill='#aaa', width=0)
-            return top, right, bottom, left
-
         # Traffic light itself
+        lenses, box = traffic_light(ROADS_W, ROADS_H)
         self.light_lens = {
-            side: i
-            for side, i in zip('TRBL', make_traffic_light())
+            side: canvas.create_oval(*coords, width=0)
+            for side, coords in lenses.items()
         }
+        canvas.create_rectangle(*box, fill=LIGHT_BOX_COLOR, width=0)
 
         Button(self, text='<<', command=self._sim_speed_decrease, font=FONT)\
             .place(x=580, y=5, width=40, height=40)
@@ -285,49 +206,32 @@ class App(Tk):
         self.speed_label = Label(self, font=FONT)
         self.speed_label.place(x=700, y=5, height=40, width=250)
 
+    def _draw_seek_bar(self):
+        self.seek_bar = Scale(self, from_=0, to=self.model.duration,
+                              orient='horizontal', showvalue=False,
+                              command=self._on_seek)
+        self.seek_bar.place(x=80, y=600, width=1070, height=30)
+
+    def _on_seek(self, value: str):
+        # moving the bar along with the playback calls this as well
+        if abs(float(value) - self.model.time) >= 1:
+            self.model.seek(float(value))
+            self._update_graph()
+
     def _sim_speed_increase(self):
         cur = self.simulation_speed_factor
-        self.simulation_speed_factor = min(cur*2, 5*self.frame_rate)
+        self.simulation_speed_factor = min(cur*2, self._max_speed_factor)
 
     def _sim_speed_decrease(self):
         cur = self.simulation_speed_factor
         self.simulation_speed_factor = max(cur//2, 1)
 
     def _add_arrow(self, pside: str, p_ind: int, cside: str, c_ind: int):
-        ROADS_W, ROADS_H = self.model.width, self.model.height
-        X_MID = ROAD_PAD_XY + ROADS_W*(ROAD_WIDTH + 1) - 1
-        Y_MID = ROAD_PAD_XY + ROADS_H*(ROAD_WIDTH + 1) - 1
-
-        P_SHIFT = (ROAD_WIDTH + 1)*(p_ind + 1) - ROAD_WIDTH // 2
-        C_SHIFT = (ROAD_WIDTH + 1)*(c_ind + 1) - ROAD_WIDTH // 2
-
-        x, y, x1, y1 = [ROAD_PAD_XY for _ in '1234']
-        match pside:
-            case 'T':
-                x += P_SHIFT
-            case 'R':
-                x = 2*X_MID - x
-                y += P_SHIFT
-            case 'B':
-                x = 2*X_MID - x - P_SHIFT
-                y = 2*Y_MID - y
-            case 'L':
-                y = 2*Y_MID - y - P_SHIFT
-        match cside:
-            case 'T':
-                x1 = 2*X_MID - x1 - C_SHIFT
-            case 'R':
-                x1 = 2*X_MID - x1
-                y1 = 2*Y_MID - y1 - C_SHIFT
-            case 'B':
-                x1 += C_SHIFT
-                y1 = 2*Y_MID - y1
-            case 'L':
-                y1 += C_SHIFT
-
+        coords = arrow(self.model.width, self.model.height,
+                       pside, p_ind, cside, c_ind)
         return (self.canvas.create_line(
-            x, y, x1, y1, arrow='last', width=ARROW_WIDTH, fill='#ff8800'),
-            (x, y, x1, y1)
+            *coords, arrow='last', width=ARROW_WIDTH, fill=ARROW_COLOR),
+            coords
         )
 
     @property
@@ -347,30 +251,35 @@ class App(Tk):
     def frame_rate(self, value):
         self._frame_rate = value
         self.timer.delay = 1/value
+        if not self._replay:
+            self._max_speed_factor = 5*value
 
     def close(self):
         self.running = False
 
     def update(self, dt) -> None:
         super().update()
-        for exit, (_, arrow_id, (x, y, x1, y1), dur) in self.arrows.items():
-            t = exit.consumption_time/dur
-            coords = (x*t + x1*(1-t), y*t + y1*(1-t), x1, y1)
-            self.canvas.coords(arrow_id, coords)
+        if self._view is not None:
+            self._sync_view(self._view)
+        else:
+            for exit, (_, arrow_id, coords, dur) in self.arrows.items():
+                self._move_arrow(arrow_id, coords, exit.consumption_time/dur)
 
         self._graph_update_delay -= dt
         if self._graph_update_delay > 0:
             return
         self._graph_update_delay += GRAPH_UPDATE_INTERVAL
         self._update_graph()
+        if self._replay:
+            self.seek_bar.set(self.model.time)
 
     def _update_graph(self):
         for model in self.models:
-            coords = model.traffic_light.get_samples()
+            coords = model.get_samples()
             self._plots_info[model].set_data(coords[0], coords[3])
 
         self.graph.set_xlim(coords[0, 0] - 2, coords[0, -1] + 2)
-        self.graph.set_ylim(-2, max(m.traffic_light.get_samples()[1:3].max()
+        self.graph.set_ylim(-2, max(m.get_samples()[1:3].max()
                             for m in self.models))
         self.figure.canvas.draw()
         self.figure.canvas.flush_events()
@@ -379,13 +288,18 @@ class App(Tk):
         self._plots_info = {
             model: self.graph.plot(coords[0], coords[3], label=label)[0]
             for (model, label) in zip(self.models, self.labels)
-            for coords in [model.traffic_light.get_samples()]
+            for coords in [model.get_samples()]
         }
         self.graph.legend()
 
         while self.running:
             with self.timer:
                 model_tick = self._simulation_speed_factor/self._frame_rate
+                # workers tick concurrently, wait for all before drawing
                 [m.tick(model_tick) for m in self.models]
+                [w.sync() for w in self._workers]
                 self.update(model_tick)
                 self.update_idletasks()
+        [w.close() for w in self._workers]
+        if self._replay:
+            self.model.close()
@@ -0,0 +1,252 @@
+import random as r
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from types import SimpleNamespace
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from intersection import Intersection
+from lib import (TrafficLight, TrafficFlowLaw, SharedArrays, SIDES,
+                 LIGHT_CYCLE_DUR)
+
+
+DEFAULT_SPLITS = (0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8)
+# a split takes effect at the next phase switch, there are two per cycle
+DEFAULT_DECISION_INTERVAL = LIGHT_CYCLE_DUR/2
+DEFAULT_DT = 0.1
+
+
+# Light whose green split is chosen from outside instead of `optimize`
+class ControlledTrafficLight(TrafficLight):
+    def set_split(self, h_share: float):
+        # takes effect from the next phase switch
+        self._h_time = LIGHT_CYCLE_DUR*h_share
+        self._v_time = LIGHT_CYCLE_DUR - self._h_time
+
+
+class _EnvConfig(NamedTuple):
+    num_envs: int
+    width: int
+    height: int
+    # must be picklable (a module level function) to be used by workers
+    laws_factory: Callable[[], dict[str, list[TrafficFlowLaw]]]
+    splits: tuple[float, ...]
+    ticks_per_step: int
+    dt: float
+    episode_length: float
+
+    @property
+    def observation_size(self) -> int:
+        return 4*max(self.width, self.height) + 2
+
+    def layout(self) -> dict[str, tuple[tuple[int, ...], type]]:
+        n, size = self.num_envs, self.observation_size
+        return {
+            'obs': ((n, size), np.float32),
+            'final_obs': ((n, size), np.float32),
+            'rewards': ((n,), np.float32),
+            'dones': ((n,), np.bool_),
+            'actions': ((n,), np.int64),
+        }
+
+
+# Environments [start, stop) of a batch, stepped by the process owning them:
+# actions are read from and results written to the arrays of the whole batch
+class _Shard:
+    def __init__(self, config: _EnvConfig, arrays: SimpleNamespace,
+                 start: int, stop: int):
+        self.config = config
+        self.arrays = arrays
+        self.start = start
+        self.models: list[Intersection] = [None]*(stop - start)
+        self._elapsed = [0.0]*(stop - start)
+        self._seeds = [None]*(stop - start)
+
+    def _reset_env(self, j: int):
+        config, seed = self.config, self._seeds[j]
+        self.models[j] = Intersection(
+            config.width, config.height, ControlledTrafficLight,
+            config.laws_factory() if config.laws_factory else None,
+            seed=seed
+        )
+        self._elapsed[j] = 0.0
+        if seed is not None:
+            self._seeds[j] = seed + config.num_envs
+        self._observe(j)
+
+    def _observe(self, j: int):
+        model, obs = self.models[j], self.arrays.obs[self.start + j]
+        size = max(self.config.width, self.config.height)
+        for k, side in enumerate(SIDES):
+            for road in model.roads[side][0]:
+                obs[k*size + road.pos] = road.car_count
+        obs[-2] = model.roads['L'][0][0].current_light == 'G'
+        obs[-1] = model.traffic_light.time_until_switch/LIGHT_CYCLE_DUR
+
+    def reset(self, seed: int = None):
+        # env i is seeded with seed + i, its k-th auto-reset with
+        # seed + i + k*num_envs
+        for j in range(len(self.models)):
+            self._seeds[j] = None if seed is None else seed + self.start + j
+            self._reset_env(j)
+
+    def step(self):
+        config, arrays = self.config, self.arrays
+        dt, ticks = config.dt, config.ticks_per_step
+        for j, model in enumerate(self.models):
+            i = self.start + j
+            light = model.traffic_light
+            light.set_split(config.splits[arrays.actions[i]])
+            waited = light.total_waiting
+            tick = model.tick
+            for _ in range(ticks):
+                tick(dt)
+            arrays.rewards[i] = -(light.total_waiting - waited)/(ticks*dt)
+            self._elapsed[j] += ticks*dt
+            self._observe(j)
+
+            arrays.dones[i] = self._elapsed[j] >= config.episode_length
+            if arrays.dones[i]:
+                arrays.final_obs[i] = arrays.obs[i]
+                self._reset_env(j)
+
+
+def _run_shard(conn: Connection, names: dict[str, str], config: _EnvConfig,
+               start: int, stop: int):
+    arrays = SharedArrays(config.layout(), names)
+    shard = _Shard(config, arrays, start, stop)
+    while (command := conn.recv()) is not None:
+        match command:
+            case ('reset', seed):
+                shard.reset(seed)
+            case 'step':
+                shard.step()
+        conn.send(True)
+    del shard
+    arrays.close()
+
+
+# Gym-style vectorized environment over a batch of intersections, stepped
+# in-process (`workers=0`) or in shards by worker processes that share the
+# observation, reward, done and action arrays with the parent.
+#   observation: cars queued at every producer road (side-major, padded to
+#                the longest side), 1 if L/R has green else 0, share of the
+#                cycle left until the next switch
+#   action:      index into `splits`, the share of the cycle given to L/R
+#   reward:      minus the mean number of waiting cars during the step
+# Finished environments are reset right away, their last observation goes
+# to infos[i]['final_observation']. The returned arrays are reused by the
+# next step. `BatchedIntersectionEnv` (batched_env.py) steps the same
+# environments as arrays, much faster
+class VecIntersectionEnv:
+    def __init__(self,
+                 num_envs: int,
+                 width: int = 3,
+                 height: int = 3,
+                 laws_factory: Callable[[], dict[str, list[TrafficFlowLaw]]]
+                 = None,
+                 splits: tuple[float, ...] = DEFAULT_SPLITS,
+                 decision_interval: float = DEFAULT_DECISION_INTERVAL,
+                 episode_length: float = 3600,
+                 dt: float = DEFAULT_DT,
+                 workers: int = 0):
+        self.num_envs = num_envs
+        self.width = width
+        self.height = height
+        self.splits = splits
+        self._config = _EnvConfig(
+            num_envs, width, height, laws_factory, splits,
+            max(1, round(decision_interval/dt)), dt, episode_length
+        )
+        self.observation_shape = (self._config.observation_size,)
+        self.action_count = len(splits)
+
+        layout = self._config.layout()
+        self._conns: list[Connection] = []
+        self._processes: list[Process] = []
+        if workers:
+            self._arrays = SharedArrays(layout)
+            bounds = np.linspace(0, num_envs, min(workers, num_envs) + 1)
+            bounds = bounds.round().astype(int)
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                conn, child_conn = Pipe()
+                process = Process(
+                    target=_run_shard,
+                    args=(child_conn, self._arrays.names, self._config,
+                          int(start), int(stop)),
+                    daemon=True
+                )
+                process.start()
+                self._conns.append(conn)
+                self._processes.append(process)
+            self._shard = None
+        else:
+            self._arrays = SimpleNamespace(**{
+                name: np.zeros(shape, dtype)
+                for name, (shape, dtype) in layout.items()
+            })
+            self._shard = _Shard(self._config, self._arrays, 0, num_envs)
+
+    @property
+    def models(self) -> list[Intersection]:
+        # in-process environments only
+        return self._shard.models if self._shard else []
+
+    def _run(self, command):
+        if self._shard:
+            if command == 'step':
+                self._shard.step()
+            else:
+                self._shard.reset(command[1])
+            return
+        for conn in self._conns:
+            conn.send(command)
+        for conn in self._conns:
+            conn.recv()
+
+    def reset(self, seed: int = None) -> np.ndarray:
+        self._run(('reset', seed))
+        return self._arrays.obs
+
+    def step(self, actions: np.ndarray
+             ) -> tuple[np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        arrays = self._arrays
+        arrays.actions[:] = actions
+        self._run('step')
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(arrays.dones):
+            infos[i]['final_observation'] = arrays.final_obs[i].copy()
+        return arrays.obs, arrays.rewards, arrays.dones, infos
+
+    def sample_actions(self) -> np.ndarray:
+        return np.array([r.randrange(self.action_count)
+                         for _ in range(self.num_envs)])
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(None)
+        for process in self._processes:
+            process.join()
+        if self._shard is None:
+            self._arrays.close()
+        self._conns, self._processes = [], []
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+
+    # `vec_env.py [workers]`, by default one per cpu
+    workers = int(sys.argv[1]) if sys.argv[1:] else os.cpu_count()
+    for count in sorted({0, workers}):
+        env = VecIntersectionEnv(64, workers=count)
+        env.reset(seed=0)
+        steps, start = 0, time.perf_counter()
+        while steps < 64*20:
+            env.step(env.sample_actions())
+            steps += env.num_envs
+        print(f"{count} workers: "
+              f"{steps/(time.perf_counter() - start):.0f} env-steps/s")
+        env.close()
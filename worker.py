@@ -0,0 +1,68 @@
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+
+from intersection import Intersection
+from lib import (SharedModelState, TrafficFlowLaw, TrafficLight,
+                 ApproachTurnProbabilities, OPT_LIGHT_HISTORY_SIZE)
+
+
+def _run_model(conn: Connection, names: dict[str, str], width: int,
+               height: int, light_type: type[TrafficLight],
+               laws: dict[str, list[TrafficFlowLaw]],
+               turn_probabilities: dict[str, ApproachTurnProbabilities]):
+    model = Intersection(width, height, light_type, laws, turn_probabilities)
+    state = SharedModelState(width, height, OPT_LIGHT_HISTORY_SIZE, names)
+    model.light_changed += state.on_light_changed
+    model.car_entered_intersection += state.on_car_entered
+    model.exit_road_cleared += state.on_exit_cleared
+
+    time = 0.0
+    while (dt := conn.recv()) is not None:
+        model.tick(dt)
+        time += dt
+        state.update(time, model.roads, model.get_samples())
+        conn.send(time)
+    state.close()
+
+
+# Intersection ticking in its own process; its state is published through
+# shared memory and read by the parent in place
+class ModelWorker:
+    def __init__(self, width: int, height: int,
+                 light_type: type[TrafficLight],
+                 laws: dict[str, list[TrafficFlowLaw]] = None,
+                 turn_probabilities: dict[str, ApproachTurnProbabilities]
+                 = None):
+        self.width = width
+        self.height = height
+        self.state = SharedModelState(width, height, OPT_LIGHT_HISTORY_SIZE)
+
+        self._conn, child_conn = Pipe()
+        self._pending = False
+        self._process = Process(
+            target=_run_model,
+            args=(child_conn, self.state.names, width, height, light_type,
+                  laws, turn_probabilities),
+            daemon=True
+        )
+        self._process.start()
+
+    def tick(self, dt: float):
+        # does not wait for the worker, call `sync` before reading the state
+        self.sync()
+        self._conn.send(dt)
+        self._pending = True
+
+    def sync(self):
+        if self._pending:
+            self._conn.recv()
+            self._pending = False
+
+    def get_samples(self):
+        return self.state.get_samples()
+
+    def close(self):
+        self.sync()
+        self._conn.send(None)
+        self._process.join()
+        self.state.close()